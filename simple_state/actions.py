@@ -1,3 +1,4 @@
+import inspect
 from .core import *
 from .drawable import *
 KEY_HOLD_TIME = .2
@@ -18,16 +19,22 @@ class FFAction:
     """
     Base class for executing different events during a state
     """
-    def __init__(self, state = None, name = "op_default", events = (), label = "Default"):
+    def __init__(self, state = None, name = "op_default", events = (), label = "Default", priority = 0):
+        """
+        Keyword Arguments:
+            priority (int) - Actions with higher priority receive events before their siblings
+        """
 
         self.name = name
         self.label = label
         self.state = state
+        self.priority = priority
         self.parent_event = None
 
         self.actions = []
         self.actions_dict = {}
         self._callback_dict = {}
+        self._callback_priority = {}
 
         self.addCallback('onEnter',self._onEnter)
         self.addCallback('onStart',self._startAction)
@@ -38,28 +45,54 @@ class FFAction:
         for a in events:
             self.hookAction(a)
 
-    def _executeEvent(self, event_type=None, **kwargs):
-        if event_type in self._callback_dict:
-            self.state.debug("%s in callback for %s" % (event_type, self.name), Debug.EVENTLOOP)
+    def _executeEvent(self, event):
+        event_type = event.event_type
+        callback_funcs = self._callback_dict.get(event_type)
+        if callback_funcs is not None:
+            if Debug.EVENTLOOP:
+                self.state.debug("%s in callback for %s" % (event_type, self.name), Debug.EVENTLOOP)
             
-            callback_funcs = self._callback_dict[event_type]
-            for func in callback_funcs:
-                self.state.debug(str(func), Debug.EVENTLOOP)
-                func.__func__(self, **kwargs)
+            profiler = self.state.alloc_profiler
+            if profiler is not None:
+                start = profiler.actionBegin()
 
-    def _startAction(self,**kwargs):
+            for func in callback_funcs:
+                if Debug.EVENTLOOP:
+                    self.state.debug(str(func), Debug.EVENTLOOP)
+                if func.__func__(self, event):
+                    event.consume()
+                if event.consumed:
+                    if Debug.EVENTLOOP:
+                        self.state.debug("%s consumed by %s" % (event_type, self.name), Debug.EVENTLOOP)
+                    break
+
+            if profiler is not None:
+                profiler.actionEnd(self.name, event_type, start)
+
+    def _startAction(self, event = None):
         self.start()        
 
-    def _onEnter(self,**kwargs):
+    def _onEnter(self, event = None):
         self.init()
 
-    def _onExit(self,**kwargs):
+    def _onExit(self, event = None):
         self.exit()
 
+    def _prewarmAction(self):
+        return self.prewarm()
+
     """ OVERLOAD FUNCTIONS"""
 
     def init(self):
         pass
+
+    def prewarm(self):
+        """
+        Prepares resources ahead of start() so switching to the action is cheap,
+        called after init() when the parent ToggleManager pre-warms its actions.
+        Can be a generator to spread the work over idle ticks.
+        """
+        pass
         
     def start(self):
         s = self.state
@@ -68,27 +101,59 @@ class FFAction:
     def exit(self):
         pass
 
+    def qualityChanged(self, level):
+        """
+        Called on every action when the state quality level changes (0 = full quality),
+        degrade optional work here - see state.quality.scale() and state.quality.allow()
+        """
+        pass
+
     """ PUBLIC FUNCTIONS"""
 
-    def passEvent(self, event_type = None, pass_down = True, **kwargs):
+    def passEvent(self, event_type = None, event = None, pass_down = True):
         """
         Passes events from parent to child + executes events on current FFAction object
+        Propagation stops as soon as a handler consumes the event.
+        The same FFEvent object travels through the whole tree, callbacks receive it as their only argument
+
+        Keyword Arguments:
+            event (FFEvent) - event to pass, a reusable one is taken from the state if None
+
+        Returns:
+            True if the event was consumed
         """
-        
-        self.state.debug("%s passing through %s" % (event_type, self.name), Debug.EVENTLOOP)
+        if event is None:
+            event = self.state.beginEvent(event_type)
+            try:
+                return self.passEvent(event_type, event, pass_down)
+            finally:
+                self.state.endEvent(event)
+
+        if Debug.EVENTLOOP:
+            self.state.debug("%s passing through %s" % (event.event_type, self.name), Debug.EVENTLOOP)
 
         if pass_down:
             for a in self.actions:
-                a.passEvent(event_type = event_type, **kwargs)
+                if a.passEvent(event_type, event):
+                    return True
 
-        self._executeEvent(event_type = event_type, **kwargs)
+        self._executeEvent(event)
+        return event.consumed
 
-    def passEventToParent(self, event_type = None, **kwargs):
-        self.state.debug("%s returning %s" % (event_type, self.name), Debug.EVENTLOOP)
+    def passEventToParent(self, event_type = None):
+        if Debug.EVENTLOOP:
+            self.state.debug("%s returning %s" % (event_type, self.name), Debug.EVENTLOOP)
 
         parent = self.parent_event
-        if parent is not None:
-            parent.passEvent(event_type, pass_down = False, origin = self, **kwargs)
+        if parent is None:
+            return False
+
+        event = self.state.beginEvent(event_type)
+        event.origin = self
+        try:
+            return parent.passEvent(event_type, event, pass_down = False)
+        finally:
+            self.state.endEvent(event)
 
     def hookAction(self, action):
         """
@@ -97,17 +162,25 @@ class FFAction:
         action.parent_event = self
         self.actions_dict[action.name] = action
         self.actions.append(action)
+        self.actions.sort(key = lambda a: -a.priority)
         self.state.debug("%s hooked to parent %s" % (action.name, self.name), Debug.EVENTLOOP)
 
-    def addCallback(self, name, func):
+    def addCallback(self, name, func, priority = 0):
+        """
+        Registers func for event 'name', callbacks with higher priority run first.
+        Callbacks are called with the FFEvent as their only argument,
+        a callback returning True consumes the event.
+        """
         callback_funcs = self._callback_dict.get(name, [])
         if func not in callback_funcs:
+            self._callback_priority[(name, func)] = priority
             callback_funcs.append(func)
+            callback_funcs.sort(key = lambda f: -self._callback_priority[(name, f)])
         self._callback_dict[name] = callback_funcs
 
     def getAction(self, action_id):
         if isinstance(action_id, str):
-            return self.actions_dict.get(action_name,None)
+            return self.actions_dict.get(action_id,None)
         if isinstance(action_id, int):
             key = list(self.actions_dict)[action_id]
             return self.actions_dict.get(key,None)
@@ -115,6 +188,28 @@ class FFAction:
     def getActionList(self):
         return list(self.actions_dict.values())
 
+    def scheduleTask(self, generator, name = None, priority = 0, on_done = None, delay = 0.0, budget = None):
+        """
+        Runs a generator task in idle time on the main thread,
+        each yield hands control back to Houdini if the time budget is used up,
+        yielding a number sleeps for that many seconds
+
+        Keyword Arguments:
+            name (str) - scheduling a task with the same name replaces the queued one
+            priority (int) - higher priority tasks run first
+            on_done (callable) - called with the finished IdleTask
+            delay (float) - seconds before the task runs for the first time
+            budget (float) - seconds the task may run per tick, defaults to the scheduler's task_budget
+
+        Returns:
+            IdleTask
+        """
+        return self.state.scheduler.schedule(generator, name = name, priority = priority,
+            owner = self, on_done = on_done, delay = delay, budget = budget)
+
+    def cancelTasks(self):
+        self.state.scheduler.cancelOwner(self)
+
 class FFStateAction(FFAction):
     """
     Passthrough FFAction from FFState that handles all 
@@ -162,27 +257,24 @@ class ParmAction(FFAction):
 
         self.addCallback('onParmChanged', self._onParmChanged)
 
-    def _onParmChanged(self,**kwargs):
+    def _onParmChanged(self, event = None):
         self.parms_changed = []
         parm_names = self.state.ui.parms_changed
         used_parms = []
 
+        # echoes of our own writes never get here, see FFState.expectEcho()
         for ff_parm in self.parms.values():
             if ff_parm is not None:
                 if ff_parm.name in parm_names:
-                    just_set = ff_parm.just_set
                     ff_parm.update()
-                    if just_set:
-                        break
                     self.state.debug("%s changed" % ff_parm.name, Debug.PARMS)
                     used_parms.append(ff_parm.name)
         
         if len(used_parms) > 0:
             self.parms_changed = used_parms
-            kwargs["parms_changed"] = used_parms
-            self.onParmChanged(**kwargs)
+            self.onParmChanged(event)
         
-    def onParmChanged(self,**kwargs):
+    def onParmChanged(self, event = None):
         pass
 
     """ PUBLIC FUNCTIONS"""
@@ -191,7 +283,7 @@ class ParmAction(FFAction):
         node = self.state.node
         if node is not None:
             new_parm = FFParm(self.state, parm_path, node.parm(parm_path), is_hud = False)
-            self.state.parms[parm_path] = new_parm
+            self.state.registerParm(new_parm)
             self.parms[parm_path] = new_parm
             return new_parm
         else:
@@ -209,6 +301,9 @@ class ToggleAction(ParmAction):
     finish()
 
     """
+    #Minimum time in seconds between refresh() calls at the first degraded quality level
+    REFRESH_INTERVAL = 0.05
+
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
 
@@ -217,23 +312,25 @@ class ToggleAction(ParmAction):
         self.is_active = False
         self.toggle_manager = None
 
-    def _startAction(self,**kwargs):
+    def _startAction(self, event = None):
         if not self.is_active:
             self.is_active = True
+            if self.toggle_manager is not None:
+                self.toggle_manager.activate(self)
             self.start()
 
-    def _refreshAction(self,**kwargs):
-        if self.is_active:
+    def _refreshAction(self, event = None):
+        if self.is_active and self.state.quality.allow(("refresh", self.name), self.REFRESH_INTERVAL):
             self.refresh()
 
-    def _finishAction(self,**kwargs):
+    def _finishAction(self, event = None):
         if self.is_active:
             self.finish()
             self.is_active = False
+            if self.toggle_manager is not None:
+                self.toggle_manager.deactivate(self)
 
-    def _toggleEvent(self,**kwargs):
-        force = kwargs.get("force", None)
-        
+    def _toggleEvent(self, force = None):
         if (self.is_active and force==None) or force==False:
             self.state.debug("Toggle %s off" % self.name, Debug.TOGGLE)
             self._finishAction()
@@ -243,15 +340,12 @@ class ToggleAction(ParmAction):
 
         self.passEventToParent('onToggleChange')
 
-    def _onExit(self,**kwargs):
-        self._finishAction(**kwargs)
-        super()._onExit(**kwargs)
+    def _onExit(self, event = None):
+        self._finishAction(event)
+        super()._onExit(event)
         
-    def passEvent(self, event_type = None, **kwargs):
-
-        if not self.is_active:
-            kwargs['pass_down'] = False
-        super().passEvent(event_type, **kwargs)
+    def passEvent(self, event_type = None, event = None, pass_down = True):
+        return super().passEvent(event_type, event, pass_down and self.is_active)
 
     """ OVERLOAD FUNCTIONS"""
 
@@ -271,10 +365,18 @@ class ToggleManager(FFAction):
     Keeps track of child events and only allows one to be active at a time
     If use_default == True it uses 1st event in the list as the default
     """
-    def __init__(self, use_default = False, **kwargs):
+    def __init__(self, use_default = False, prewarm = None, **kwargs):
+        """
+        Keyword Arguments:
+            use_default (bool) - start the first action whenever no other action is active
+            prewarm (str) - None, "enter" to call prewarm() of all actions in onEnter
+                            or "idle" to run them as idle tasks
+        """
         super().__init__(**kwargs)
         self.use_default = use_default
+        self.prewarm_mode = prewarm
         self.default_event = None
+        self.active_event = None
         self.addCallback('onToggleChange', self._onToggleChange)
 
         events = kwargs["events"]
@@ -283,23 +385,49 @@ class ToggleManager(FFAction):
         for e in events:
             e.toggle_manager = self
 
-    def _onEnter(self, **kwargs):
-        super()._onEnter(**kwargs)
+    def _onEnter(self, event = None):
+        super()._onEnter(event)
         if self.use_default:
             self.default_event = self.getAction(0)
             self.default_event.passEvent('onStart')
 
-    def _onToggleChange(self,**kwargs):
-        toggle_event = kwargs["origin"]
-        
-        is_active = toggle_event.isActive()
-        if is_active:
-            for a in self.getActionList():
-                if a.name != toggle_event.name:
-                    a.passEvent('onFinish')
-        else:
-            if self.default_event is not None:
-                self.default_event.passEvent('onStart')
+        if self.prewarm_mode == "enter":
+            for a in self.actions:
+                for _ in self._prewarmTask(a):
+                    pass
+        elif self.prewarm_mode == "idle":
+            for a in self.actions:
+                self.scheduleTask(self._prewarmTask(a), name = "prewarm_" + a.name, priority = -1)
+
+    def _onExit(self, event = None):
+        super()._onExit(event)
+        self.cancelTasks()
+        self.active_event = None
+
+    def _prewarmTask(self, action):
+        result = action._prewarmAction()
+        if inspect.isgenerator(result):
+            yield from result
+
+    def _onToggleChange(self, event = None):
+        # siblings are already finished by activate()
+        if not event.origin.isActive() and self.default_event is not None:
+            self.default_event.passEvent('onStart')
+
+    """ PUBLIC FUNCTIONS """
+
+    def activate(self, action):
+        """
+        Called by a starting child action, finishes the previously active one
+        """
+        previous = self.active_event
+        self.active_event = action
+        if previous is not None and previous is not action and previous.isActive():
+            previous.passEvent('onFinish')
+
+    def deactivate(self, action):
+        if self.active_event is action:
+            self.active_event = None
 
 class KeyAction(ParmAction):
     """
@@ -309,14 +437,24 @@ class KeyAction(ParmAction):
 
         super().__init__(**kwargs)
         self.hotkey = hotkey
-        state.ui.addKey(hotkey)
+        self.key_consumed = False
+        self.state.ui.addKey(hotkey)
 
         self.addCallback('onKeyDown',self._onKeyDown)
+        self.addCallback('onKeyUp',self._onKeyUp)
 
-    def _onKeyDown(self,**kwargs):
+    def _onKeyDown(self, event = None):
         ui = self.state.ui
-        if ui.key_pressed[self.hotkey]:
+        if ui.key == self.hotkey and ui.key_pressed[self.hotkey]:
             self._startAction()
+            self.key_consumed = True
+            return True
+
+    def _onKeyUp(self, event = None):
+        # Houdini never saw the key-down, it must not get the key-up either
+        if self.key_consumed and self.state.ui.key == self.hotkey:
+            self.key_consumed = False
+            return True
 
 class KeyToggleAction(ToggleAction):
     """
@@ -334,24 +472,31 @@ class KeyToggleAction(ToggleAction):
 
         self.hotkey = hotkey
         self.allow_hold = allow_hold
+        self.key_consumed = False
 
         state = kwargs["state"]
         state.ui.addKey(hotkey)
 
         self.addCallback('onKeyDown', self._onKeyDown)
+        self.addCallback('onKeyUp', self._onKeyUp)
 
-        if self.allow_hold:
-            self.addCallback('onKeyUp', self._onKeyUp)
-
-    def _onKeyDown(self,**kwargs):
+    def _onKeyDown(self, event = None):
         ui = self.state.ui
-        if ui.key_pressed[self.hotkey]:
+        if ui.key == self.hotkey and ui.key_pressed[self.hotkey]:
             self._toggleEvent()
+            self.key_consumed = True
+            return True
 
-    def _onKeyUp(self,**kwargs):
+    def _onKeyUp(self, event = None):
         ui = self.state.ui
-        if self.is_active and ui.key_pressed[self.hotkey] and ( ui.key_hold_time[self.hotkey] > KEY_HOLD_TIME):
+        if not self.key_consumed or ui.key != self.hotkey:
+            return
+        self.key_consumed = False
+
+        if self.allow_hold and self.is_active and ui.key_pressed[self.hotkey] and ( ui.key_hold_time[self.hotkey] > KEY_HOLD_TIME):
             self._toggleEvent()
+        # Houdini never saw the key-down, it must not get the key-up either
+        return True
 
 class DrawableAction(ToggleAction):
     """
@@ -359,55 +504,70 @@ class DrawableAction(ToggleAction):
     """
     def __init__(self, **kwargs):
         self.drawables = {}
+        self.drawable_batch = DrawableBatch()
+        self.is_prewarmed = False
 
         super().__init__(**kwargs)
 
         self.addCallback('onDraw', self._drawAction)
         self.addCallback('onParmChanged', self._drawAction)
     
-    def _startAction(self,**kwargs):
-        super()._startAction(**kwargs)
+    def _startAction(self, event = None):
+        super()._startAction(event)
         for d in self.drawables.values():
             self.state.debug("%s enabled" % d.name, Debug.DRAW)
             d.enable(True)
             d.show(True)
 
-    def _refreshAction(self,**kwargs):
-        super()._refreshAction(**kwargs)
+    def _refreshAction(self, event = None):
+        super()._refreshAction(event)
         if self.is_active:
-            for d in self.drawables.values():
-                d.update()
+            self.updateDrawables()
         
-    def _finishAction(self,**kwargs):
-        super()._finishAction(**kwargs)
+    def _finishAction(self, event = None):
+        super()._finishAction(event)
         for d in self.drawables.values():
             self.state.debug("%s disabled" % d.name, Debug.DRAW)
-            d.enable(False)
+            # pre-warmed drawables stay enabled, hiding them is enough
+            if not self.is_prewarmed:
+                d.enable(False)
             d.show(False)
 
-    def _drawAction(self,**kwargs):
+    def _prewarmAction(self):
+        if not self.is_active:
+            for d in self.drawables.values():
+                d.enable(True)
+                d.show(False)
+            self.updateDrawables()
+        self.is_prewarmed = True
+        return super()._prewarmAction()
+
+    def _drawAction(self, event = None):
         if self.is_active:
             self.draw()
             self.state.debug("Updating drawable xform", Debug.DRAW)
-            for d in self.drawables.values():
-                d.update()
+            self.updateDrawables()
             
 
-    def _onExit(self,**kwargs):
-        super()._onExit(**kwargs)
+    def _onExit(self, event = None):
+        super()._onExit(event)
         self.state.log("Exiting")
         for d in self.drawables.values():
-            del d
+            d.enable(False)
+            d.show(False)
+        self.is_prewarmed = False
 
     """ PUBLIC FUNCTIONS"""
 
-    def bindDrawable(self, geo = hou.drawablePrimitive.Sphere, name = "tool"):
+    def bindDrawable(self, geo = hou.drawablePrimitive.Sphere, name = "tool", world_space = False):
         """
         Creates and binds a drawable object to the action.
 
         Keyword Arguments:
             geo (hou.Geometry) - Base Geometry for drawable
             name (str) - name id of the drawable - two drawables with the same name can't exist
+            world_space (bool) - geo is already in world space, the drawable keeps an identity
+                                 transform and is not part of the drawable batch
         
         Returns:
             A FFDrawable object (subclass of hou.SimpleDrawable)
@@ -417,11 +577,23 @@ class DrawableAction(ToggleAction):
             if self.state.scene_viewer is not None:
                 drawable = FFDrawable(self.state, geo, name)
                 self.drawables[name] = drawable
+                if world_space:
+                    drawable.setTransform(hou.Matrix4(1))
+                else:
+                    self.drawable_batch.add(drawable)
         else:
             drawable = self.drawables[name]
         
         return drawable
 
+    def updateDrawables(self):
+        """
+        Composes transforms of all bound drawables in one batched operation
+        """
+        if len(self.drawable_batch) > 0:
+            parent = ancestorObject(self.state.node)
+            self.drawable_batch.update(parent.worldTransform())
+
     """ OVERLOAD FUNCTIONS"""
 
     def draw(self):
@@ -440,16 +612,16 @@ class MenuParmAction(ToggleAction):
 
         super().__init__(**kwargs)
 
-    def _onEnter(self, **kwargs):
-        super()._onEnter(**kwargs)
+    def _onEnter(self, event = None):
+        super()._onEnter(event)
         parm = self.hookParm(self.menu_parm)
 
         if parm is not None:
             if parm.eval() == self.menu_id:
                 self._startAction()
 
-    def _onParmChanged(self,**kwargs):
-        super()._onParmChanged(**kwargs)
+    def _onParmChanged(self, event = None):
+        super()._onParmChanged(event)
         parms = self.parms_changed
 
         if self.menu_parm in parms:
@@ -458,7 +630,7 @@ class MenuParmAction(ToggleAction):
             if val == self.menu_id:
                 self._toggleEvent(force=True)
 
-    def _startAction(self, **kwargs):
+    def _startAction(self, event = None):
         super()._startAction()
         self.state.debug("Menu %s action started" % self.name, Debug.PARMS)
 
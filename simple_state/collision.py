@@ -0,0 +1,274 @@
+import numpy as np
+import hou
+
+from . import vmath
+from . import diskcache
+
+"""
+
+Batched ray casting against static collision geometry.
+The geometry is triangulated once into flat NumPy arrays and a uniform grid
+of triangle lists (sorted cell keys + CSR offsets). All arrays are plain
+ndarrays, so a TriangleGrid can be stored in a diskcache.DiskCache and
+memory-mapped back instead of being rebuilt.
+
+"""
+
+# only closed triangles are kept - polylines, points, packed or volume prims would shift the vertex triplets
+TRIANGLE_FILTER_SNIPPET = """
+if (primintrinsic(0, "typename", @primnum) != "Poly" || !primintrinsic(0, "closed", @primnum)
+    || primvertexcount(0, @primnum) != 3)
+    removeprim(0, @primnum, 0);
+"""
+
+# vertex -> point index, HOM has no bulk accessor for it
+POINT_INDEX_SNIPPET = "i@__ptnum = vertexpoint(0, @vtxnum);"
+
+def readTriangles(geo):
+    """
+    Triangulates polygons of geo and returns (positions (N,3), triangles (M,3)),
+    primitives that are not closed polygons are ignored
+    """
+    category = hou.sopNodeTypeCategory()
+    divided = hou.Geometry()
+    divide = category.nodeVerb("divide")
+    divide.setParms({"convex": True})
+    divide.execute(divided, [geo])
+
+    triangles = hou.Geometry()
+    wrangle = category.nodeVerb("attribwrangle")
+    wrangle.setParms({"class": 1, "snippet": TRIANGLE_FILTER_SNIPPET})
+    wrangle.execute(triangles, [divided])
+
+    indexed = hou.Geometry()
+    wrangle.setParms({"class": 3, "snippet": POINT_INDEX_SNIPPET})
+    wrangle.execute(indexed, [triangles])
+
+    positions = np.frombuffer(indexed.pointFloatAttribValuesAsString("P"), dtype = np.float32).reshape(-1, 3)
+    vertices = np.frombuffer(indexed.vertexIntAttribValuesAsString("__ptnum"), dtype = np.int32)
+    if len(vertices) != 3 * indexed.intrinsicValue("primitivecount"):
+        raise hou.OperationFailed("Collision geometry could not be triangulated")
+    return positions, vertices.reshape(-1, 3)
+
+def packKeys(coords):
+    # 21 bits per axis, same packing as scatter.SpatialHashGrid
+    c = (coords + (1 << 20)) & ((1 << 21) - 1)
+    return (c[..., 0] << 42) | (c[..., 1] << 21) | c[..., 2]
+
+class TriangleGrid:
+    """
+    Triangles binned into a uniform grid for vectorized ray queries
+
+    Example:
+        grid = TriangleGrid.fromGeometry(collision_geo, cache = diskcache.DiskCache())
+        positions, normals, valid = grid.intersect(origins, directions, max_distance)
+    """
+    ARRAYS = ("positions", "triangles", "normals", "cell_keys", "cell_start", "cell_triangles",
+              "large_triangles", "settings")
+    #Bump when the stored arrays change, older cache entries are ignored
+    VERSION = 2
+    #Triangles overlapping more cells are not binned, they are tested against every ray
+    MAX_CELLS = 512
+
+    def __init__(self, arrays):
+        """
+        arrays - dict (or diskcache.CacheEntry) with the ARRAYS of a built grid
+        """
+        for name in self.ARRAYS:
+            setattr(self, name, arrays[name])
+        self.cell_size = float(self.settings[0])
+
+    def __len__(self):
+        return len(self.triangles)
+
+    @property
+    def nbytes(self):
+        """
+        Size of all arrays, memory-mapped ones included - used by the resource manager budget
+        """
+        return sum(int(getattr(self, name).nbytes) for name in self.ARRAYS)
+
+    @staticmethod
+    def build(positions, triangles, cell_size = None):
+        """
+        Bins triangles into grid cells, returns a dict of arrays for TriangleGrid()
+
+        Keyword Arguments:
+            cell_size (float) - grid cell size, defaults to the median triangle extent
+        """
+        positions = np.asarray(positions, dtype = np.float32)
+        triangles = np.asarray(triangles, dtype = np.int32)
+        corners = positions[triangles].astype(np.float64)
+
+        normals = np.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0])
+        normals = vmath.normalize(normals).astype(np.float32)
+
+        lo = corners.min(axis = 1)
+        hi = corners.max(axis = 1)
+        if cell_size is None:
+            extent = (hi - lo).max(axis = 1)
+            diagonal = np.linalg.norm(positions.max(axis = 0) - positions.min(axis = 0)) if len(positions) else 1.0
+            cell_size = max(float(np.median(extent)) if len(extent) else 0.0, diagonal / 512.0, vmath.EPSILON)
+
+        # bounds are grown by half a cell so ray samples taken every half cell can't miss a triangle
+        lo = np.floor((lo - cell_size*0.5) / cell_size).astype(np.int64)
+        hi = np.floor((hi + cell_size*0.5) / cell_size).astype(np.int64)
+        span = hi - lo + 1
+        counts = span.prod(axis = 1)
+
+        # a few huge triangles among small ones would add span^3 pairs each
+        large = counts > TriangleGrid.MAX_CELLS
+        counts[large] = 0
+
+        # one (cell, triangle) pair for every cell a triangle overlaps
+        owner = np.repeat(np.arange(len(triangles)), counts)
+        local = np.arange(len(owner)) - np.repeat(np.cumsum(counts) - counts, counts)
+        span = span[owner]
+        offset = np.stack((local // (span[:, 1]*span[:, 2]), (local // span[:, 2]) % span[:, 1], local % span[:, 2]), axis = 1)
+        keys = packKeys(lo[owner] + offset)
+
+        order = np.argsort(keys, kind = "stable")
+        keys = keys[order]
+        cell_keys, cell_start = np.unique(keys, return_index = True)
+
+        return {
+            "positions": positions,
+            "triangles": triangles,
+            "normals": normals,
+            "cell_keys": cell_keys,
+            "cell_start": np.append(cell_start, len(keys)).astype(np.int64),
+            "cell_triangles": owner[order].astype(np.int32),
+            "large_triangles": np.flatnonzero(large).astype(np.int32),
+            "settings": np.array([cell_size]),
+        }
+
+    @classmethod
+    def fromGeometry(cls, geo, cache = None, cell_size = None):
+        """
+        Builds a grid from hou.Geometry, or maps it from cache
+        when the same geometry content was built before.
+        The cache is best-effort, if it can't be read or written the grid is built in memory
+        """
+        positions, triangles = readTriangles(geo)
+        arrays = {}
+        def build():
+            arrays.update(cls.build(positions, triangles, cell_size = cell_size))
+            return arrays
+
+        if cache is None:
+            return cls(build())
+
+        # triangles carry connectivity and winding, rewired geometry with the same P must not map a stale grid
+        key = diskcache.geometryHash(geo, arrays = (triangles,), extra = ("TriangleGrid", cls.VERSION, cell_size))
+        try:
+            return cls(cache.get(key, build))
+        except (OSError, KeyError, ValueError):
+            # read-only or full cache directory, or an entry evicted by another process while mapping it
+            return cls(arrays or build())
+
+    def _cellCandidates(self, origins, directions, max_distance):
+        step = self.cell_size * 0.5
+        samples = int(np.ceil(np.max(max_distance) / step)) + 1
+        t = np.arange(samples) * step
+        t = np.minimum(t[None, :], np.reshape(max_distance, (-1, 1)))
+
+        points = origins[:, None, :] + directions[:, None, :] * t[:, :, None]
+        keys = packKeys(np.floor(points / self.cell_size).astype(np.int64)).ravel()
+        rays = np.repeat(np.arange(len(origins)), samples)
+
+        cells = np.searchsorted(self.cell_keys, keys)
+        cells = np.minimum(cells, len(self.cell_keys) - 1)
+        found = self.cell_keys[cells] == keys
+        rays = rays[found]
+        cells = cells[found]
+
+        starts = self.cell_start[cells]
+        counts = self.cell_start[cells + 1] - starts
+        ray_index = np.repeat(rays, counts)
+        entry = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts) + np.repeat(starts, counts)
+        tri_index = self.cell_triangles[entry].astype(np.int64)
+
+        # neighbouring samples mostly land in the same cells
+        pairs = np.unique(ray_index * len(self.triangles) + tri_index)
+        return pairs // len(self.triangles), pairs % len(self.triangles)
+
+    """ PUBLIC FUNCTIONS """
+
+    def candidates(self, origins, directions, max_distance):
+        """
+        Returns (ray indices, triangle indices) of triangles in cells along each ray segment,
+        large unbinned triangles are candidates of every ray
+        """
+        if len(self.cell_keys) == 0:
+            rays = np.empty(0, dtype = np.int64)
+            tris = np.empty(0, dtype = np.int64)
+        else:
+            rays, tris = self._cellCandidates(origins, directions, max_distance)
+
+        large = self.large_triangles
+        if len(large):
+            rays = np.concatenate((rays, np.repeat(np.arange(len(origins)), len(large))))
+            tris = np.concatenate((tris, np.tile(large.astype(np.int64), len(origins))))
+        return rays, tris
+
+    def intersect(self, origins, directions, max_distance):
+        """
+        Casts rays (N,3) with normalized directions (N,3) up to max_distance
+
+        Returns:
+            (positions (N,3), normals (N,3) facing the ray, valid (N,) mask of rays that hit)
+        """
+        origins = np.asarray(origins, dtype = np.float64).reshape(-1, 3)
+        directions = np.broadcast_to(np.asarray(directions, dtype = np.float64), origins.shape)
+        n = len(origins)
+
+        positions = np.zeros((n, 3))
+        normals = np.zeros((n, 3))
+        valid = np.zeros(n, dtype = bool)
+        if n == 0 or len(self.triangles) == 0:
+            return positions, normals, valid
+
+        rays, tris = self.candidates(origins, directions, max_distance)
+        if len(rays) == 0:
+            return positions, normals, valid
+
+        # Moller-Trumbore for all candidate pairs at once
+        corners = self.positions[self.triangles[tris]].astype(np.float64)
+        o = origins[rays]
+        d = directions[rays]
+        e1 = corners[:, 1] - corners[:, 0]
+        e2 = corners[:, 2] - corners[:, 0]
+        p = np.cross(d, e2)
+        det = np.einsum("ij,ij->i", e1, p)
+        ok = np.abs(det) > vmath.EPSILON
+        inv = np.where(ok, 1.0 / np.where(ok, det, 1.0), 0.0)
+        s = o - corners[:, 0]
+        u = np.einsum("ij,ij->i", s, p) * inv
+        q = np.cross(s, e1)
+        v = np.einsum("ij,ij->i", d, q) * inv
+        t = np.einsum("ij,ij->i", e2, q) * inv
+
+        limit = np.broadcast_to(np.asarray(max_distance, dtype = np.float64), (n,))[rays]
+        hit = ok & (u >= 0.0) & (v >= 0.0) & (u + v <= 1.0) & (t >= 0.0) & (t <= limit)
+        rays = rays[hit]
+        tris = tris[hit]
+        t = t[hit]
+        if len(rays) == 0:
+            return positions, normals, valid
+
+        # closest hit per ray
+        order = np.lexsort((t, rays))
+        rays = rays[order]
+        first = np.ones(len(rays), dtype = bool)
+        first[1:] = rays[1:] != rays[:-1]
+        rays = rays[first]
+        tris = tris[order][first]
+        t = t[order][first]
+
+        positions[rays] = origins[rays] + directions[rays] * t[:, None]
+        normal = self.normals[tris].astype(np.float64)
+        facing = np.einsum("ij,ij->i", normal, directions[rays]) > 0.0
+        normal[facing] *= -1.0
+        normals[rays] = normal
+        valid[rays] = True
+        return positions, normals, valid
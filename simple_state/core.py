@@ -2,7 +2,15 @@ import hou
 import viewerstate.utils as su
 import traceback
 import time
+import functools
+import contextlib
+import re
 from . import *
+from . import profiling
+from . import vmath
+from . import scheduler
+from . import resources
+from . import quality
 
 class Debug:
     NORMAL = False
@@ -14,6 +22,47 @@ class Debug:
     KEYEVENTS = False
     DRAW = False
     MOUSEWHEEL = False
+    PROFILE = True
+
+def stateCallback(event_type):
+    """
+    Decorator for top-level FFState callbacks,
+    lets the state measure everything that happens inside one Houdini callback
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            self._beginCallback(event_type)
+            try:
+                return func(self, *args, **kwargs)
+            finally:
+                self._endCallback(event_type)
+        return wrapper
+    return decorator
+
+#Event passed down the action tree by reference, handlers can consume it to stop propagation.
+#The state keeps one instance per event type and reuses it for every callback (see FFState.beginEvent)
+class FFEvent:
+    __slots__ = ("event_type", "consumed", "in_use", "kwargs", "ui_event", "ray", "key", "parm_tuple", "origin")
+
+    def __init__(self, event_type = None):
+        self.event_type = event_type
+        self.consumed = False
+        self.in_use = False
+        self.clear()
+
+    def clear(self):
+        #Houdini callback kwargs, not copied - read only
+        self.kwargs = None
+        self.ui_event = None
+        self.ray = None
+        self.key = None
+        self.parm_tuple = None
+        #Action that sent the event with passEventToParent()
+        self.origin = None
+
+    def consume(self):
+        self.consumed = True
 
 #Class for managing parameter sync between HUD, node and internal values
 class FFParm:
@@ -24,9 +73,12 @@ class FFParm:
         self.parm = parm
         self.value = parm.eval()
         self.is_hud = is_hud
-        self.just_set = False
         self.max = None
 
+        #Deferred parms only keep the value until commit() writes it to the node
+        self.deferred = False
+        self.dirty = False
+
         template = self.parm.parmTemplate()
         if template.type() == hou.parmTemplateType.Float:
             self.max = template.maxValue()
@@ -38,16 +90,35 @@ class FFParm:
     def set(self, val):
         #self.state.log("setting %s" % self.name)
         self.value = val
+        if self.deferred:
+            self.dirty = True
+        else:
+            self._write(val)
+        if self.is_hud:
+            self.state.setHUDValue(self.name, val, bar = self.max)
+
+    def _write(self, val):
         if val != self.parm.eval():
-            with hou.undos.disabler():
+            with hou.undos.disabler(), self.state.expectEcho(self, val):
                 self.state.debug("Parm %s set" % self.name, Debug.PARMS)
-                self.just_set = True
                 self.parm.set(val)
-        if self.is_hud:
-            self.state.setHUDValue(self.name, val, bar = self.max)
+
+    def defer(self, enable = True):
+        """
+        While deferred, set() only updates the internal value (no node cook),
+        turning it off commits the pending value
+        """
+        self.deferred = enable
+        if not enable:
+            self.commit()
+
+    def commit(self):
+        if self.dirty:
+            self.dirty = False
+            self._write(self.value)
 
     def update(self):
-        self.just_set = False
+        self.dirty = False
         val = self.parm.eval()
         self.value = val
         if self.is_hud:
@@ -76,7 +147,9 @@ class FFStateTemplate(hou.ViewerStateTemplate):
                 self.hotkey_list.append(key)
 
         for key in self.hotkey_list:
-            su.hotkey(self.state_name, "hotkey_%s" % key, key, "hotkey_%s" % key)
+            # modifier combos like "Ctrl+Shift+F12" are not valid symbol names
+            symbol = "hotkey_" + re.sub(r"\W", "_", key)
+            su.hotkey(self.state_name, symbol, key, symbol)
 
 #Main state class
 class FFState(object):
@@ -99,6 +172,21 @@ class FFState(object):
         "add": "a"
     }
 
+    #Reserved hotkey that starts/stops a cProfile capture of the state callbacks
+    #set to None to disable
+    PROFILE_HOTKEY = "Ctrl+Shift+F12"
+    #Directory for profile captures, None uses $HOUDINI_TEMP_DIR/simple_state_profiles
+    PROFILE_DIR = None
+
+    #Time in seconds idle tasks may use per event loop tick
+    IDLE_BUDGET = 0.005
+
+    #Time in seconds a callback may take before optional work is degraded
+    #set to None to always run at full quality
+    LATENCY_BUDGET = 1.0/30.0
+    #Minimum time in seconds between HUD updates at the first degraded quality level
+    HUD_INTERVAL = 0.1
+
     #https://www.sidefx.com/docs/houdini/hom/hud_info.html
     HUD_TEMPLATE = {
         "title": "Default FF State", "desc": "tool", "icon": "SOP_matchsize",
@@ -117,17 +205,28 @@ class FFState(object):
             def __init__(self):
                 self.device = None
                 self.wheel = 0.0
+                self.dragging = False
+                self.reason = None
+                self.x = 0.0
+                self.y = 0.0
         
         class RayDevice:
             def __init__(self):
                 self.origin = hou.Vector3(0,0,0)
                 self.dir = hou.Vector3(0,0,0)
+                #NumPy copy of the ray, updated in place
+                self.buffer = vmath.Ray()
 
         def __init__(self):
             self.ui_event = None
             self.event_type = None
             self.device = None
+            self.viewport = None
 
+            #Index of the element under the cursor, set by hover picking (-1 = none)
+            self.hovered = -1
+
+            self.key = None
             self.keys = []
             self.key_pressed = {}
             self.key_down = {}
@@ -165,13 +264,41 @@ class FFState(object):
         self.actions = {}
         self.parms = {}
 
+        # FFParms of all actions by parm name and the pending echoes of our own writes
+        self._parm_copies = {}
+        self._echoes = {}
+
+        # reusable FFEvent per event type
+        self._events = {}
+
+        self.alloc_profiler = None
+        self.callback_profiler = None
+        self._callback_depth = 0
+        self._callback_start = 0.0
+
+        self.quality = quality.QualityController(budget = self.LATENCY_BUDGET, on_change = self._qualityChanged)
+        self._hud_pending = {}
+
+        self.scheduler = scheduler.IdleScheduler(self, budget = self.IDLE_BUDGET)
+        self.resources = resources.manager
+        self._resource_keys = {}
+
+        if self.PROFILE_HOTKEY is not None:
+            self.ui.addKey(self.PROFILE_HOTKEY)
+
         self.debug(" State '%s' Initialized" % self.state_name, Debug.BASEEVENTS)
 
         self.onBuild()
 
     """ CALLBACK FUNCTIONS """
     
+    @stateCallback('onParmChanged')
     def onParmChanged(self, **kwargs):
+        parm_tuple = kwargs['parm_tuple']
+        if parm_tuple is not None and self._isEcho(parm_tuple):
+            self.debug("onParmChanged echo dropped", Debug.PARMS)
+            return
+
         self.state_action.onParmChanged(kwargs)
 
         self.debug("onParmChanged", Debug.PARMS)
@@ -180,13 +307,15 @@ class FFState(object):
             self.ui.parms_changed = list(set([x.tuple().name() for x in parm_tuple]))
 
             if len(parm_tuple) > 0:
-                kwargs["event_type"] = 'onParmChanged'
-                self.state_action.passEvent(**kwargs)
+                self.dispatchEvent('onParmChanged', kwargs)
             
+    @stateCallback('onEnter')
     def onEnter(self, kwargs):
         self.debug(" State '%s' onEnter" % self.state_name, Debug.BASEEVENTS)
 
         self.node = kwargs["node"]
+        self._parm_copies.clear()
+        self._echoes.clear()
         if self.state_action is None:
             self.state_action = actions.FFStateAction(self, self.state_name)
 
@@ -199,10 +328,14 @@ class FFState(object):
 
         self.is_active = True
 
+        self.quality.reset()
         self.onStart()
         self.state_action.onEnter(kwargs)
-        self.state_action.passEvent(event_type='onEnter',**kwargs)
+        self.dispatchEvent('onEnter', kwargs)
+
+        self.scheduler.start(self.onIdle)
 
+    @stateCallback('onKeyTransitEvent')
     def onKeyTransitEvent(self, kwargs):
         self.state_action.onKeyTransitEvent(kwargs)
 
@@ -218,11 +351,18 @@ class FFState(object):
         if key not in ui.key_pressed.keys():
             ui.addKey(key)
 
+        if key == self.PROFILE_HOTKEY:
+            if is_down:
+                self.toggleCallbackProfiling()
+            return True
+
         # Log the key state
         ui.key = key
         ui.key_down[key] = is_down
         ui.key_up[key] = is_up
 
+        consumed = False
+
         if is_down:
             ui.key_pressed[key] = True
             ui.key_down_time[key] = time.time()
@@ -230,7 +370,7 @@ class FFState(object):
 
             self.debug("%s down" % (key),Debug.KEYEVENTS)
 
-            self.state_action.passEvent(event_type='onKeyDown', **kwargs)
+            consumed = self.dispatchEvent('onKeyDown', kwargs)
 
         if is_up:
             hold_time = time.time() - ui.key_down_time[key]
@@ -238,23 +378,41 @@ class FFState(object):
 
             self.debug("%s up after %f" % (key, hold_time),Debug.KEYEVENTS)
 
-            self.state_action.passEvent(event_type='onKeyUp', **kwargs)
+            consumed = self.dispatchEvent('onKeyUp', kwargs)
             ui.key_pressed[key] = False
 
-        return False
+        # Consumed keys are not handled by Houdini
+        return consumed
 
+    @stateCallback('onKey')
     def onKey(self, kwargs):
         self.state_action.onKey(kwargs)
-        self.state_action.passEvent(event_type='onKey')
+        return self.dispatchEvent('onKey', kwargs)
 
+    @stateCallback('onMouse')
     def onMouseEvent(self, kwargs):
 
         ui_event = kwargs['ui_event']
-        self.ui.ray.origin, self.ui.ray.dir = ui_event.ray()
+        ray = self.ui.ray
+        ray.origin, ray.dir = ui_event.ray()
+        ray.buffer.set(ray.origin, ray.dir)
+
+        mouse = self.ui.mouse
+        device = ui_event.device()
+        mouse.device = device
+        mouse.x = device.mouseX()
+        mouse.y = device.mouseY()
+
+        reason = ui_event.reason()
+        mouse.reason = reason
+        mouse.dragging = reason == hou.uiEventReason.Start or reason == hou.uiEventReason.Active
+
+        self.ui.viewport = ui_event.curViewport()
 
         self.state_action.onMouseEvent(kwargs)
-        self.state_action.passEvent(event_type='onMouse')
+        return self.dispatchEvent('onMouse', kwargs)
 
+    @stateCallback('onMouseWheel')
     def onMouseWheelEvent(self, kwargs):
 
         ui_event = kwargs['ui_event']
@@ -263,32 +421,106 @@ class FFState(object):
         self.debug("Mouse Wheel event: %d" % self.ui.mouse.wheel, Debug.MOUSEWHEEL)
 
         self.state_action.onMouseWheelEvent(kwargs)
-        self.state_action.passEvent(event_type='onMouseWheel', **kwargs)
+        return self.dispatchEvent('onMouseWheel', kwargs)
 
+    @stateCallback('onDraw')
     def onDraw(self, kwargs):
-        self.state_action.passEvent(event_type='onDraw', **kwargs)
+        self.dispatchEvent('onDraw', kwargs)
 
+    @stateCallback('onInterrupt')
     def onInterrupt(self, kwargs):
         self.debug(" State '%s' onInterrupt" % self.state_name, Debug.BASEEVENTS)
 
         self.is_active = False
         self.state_action.onInterrupt(kwargs)
 
+    @stateCallback('onResume')
     def onResume(self, kwargs):#
         self.debug(" State '%s' onResume" % self.state_name, Debug.BASEEVENTS)
 
         self.is_active = True
         self.state_action.onResume(kwargs)
 
+    @stateCallback('onExit')
     def onExit(self, kwargs):
         self.debug(" State '%s' onExit" % self.state_name, Debug.BASEEVENTS)
 
+        self.toggleCallbackProfiling(False)
+        self.scheduler.stop()
+        self.scheduler.clear()
+        self.releaseResources()
+
         if self.node is not None:
             self.debug("onParmChanged callback remove", Debug.PARMS)
             self.node.removeEventCallback([hou.nodeEventType.ParmTupleChanged], self.onParmChanged)
 
         self.state_action.onExit(kwargs)
-        self.state_action.passEvent(event_type='onExit', **kwargs)
+        self.dispatchEvent('onExit', kwargs)
+
+    def onIdle(self):
+        """
+        Houdini event loop callback, runs scheduled idle tasks
+        and shows HUD values that were held back.
+        Only ticks that run tasks are measured, idle ticks stay out of the profilers.
+        """
+        if self._hud_pending and self.quality.allow("hud", self.HUD_INTERVAL):
+            self.flushHUD()
+        if self.scheduler.isReady():
+            self._runIdleTasks()
+
+    @stateCallback('onIdle')
+    def _runIdleTasks(self):
+        self.scheduler.run(self.scheduler.budget)
+
+    """ PRIVATE FUNCTIONS """
+
+    def _beginCallback(self, event_type):
+        self._callback_depth += 1
+        if self._callback_depth > 1:
+            return
+
+        self._callback_start = time.perf_counter()
+        if self.alloc_profiler is not None:
+            self.alloc_profiler.begin(event_type)
+        if self.callback_profiler is not None:
+            self.callback_profiler.begin()
+
+    def _endCallback(self, event_type):
+        self._callback_depth -= 1
+        if self._callback_depth > 0:
+            return
+
+        if self.callback_profiler is not None:
+            self.callback_profiler.end()
+        if self.alloc_profiler is not None:
+            self.alloc_profiler.end(event_type)
+
+        self.quality.measure(event_type, time.perf_counter() - self._callback_start)
+
+    def _isEcho(self, parm_tuple):
+        """
+        True if every component of the changed parm tuple holds the value
+        this state wrote or left in it, any other value is an external edit
+        """
+        expected = self._echoes.pop(parm_tuple.name(), None)
+        if expected is None:
+            return False
+        for parm in parm_tuple:
+            value = expected.get(parm.name())
+            if value is not None and value != parm.eval():
+                return False
+        return True
+
+    def _qualityChanged(self, level):
+        self.debug("Quality level %d (%.1f ms average)" % (level, self.quality.average * 1000.0), Debug.PROFILE)
+
+        if self.state_action is None:
+            return
+        pending = [self.state_action]
+        while pending:
+            action = pending.pop()
+            action.qualityChanged(level)
+            pending.extend(action.actions)
 
     """ PUBLIC FUNCTIONS """
     
@@ -302,12 +534,113 @@ class FFState(object):
 
         updates[id_name] = value
 
-        self.scene_viewer.hudInfo(hud_values=updates)
+        # under load only the latest values are shown, at most once per HUD_INTERVAL*level
+        self._hud_pending.update(updates)
+        if self.quality.allow("hud", self.HUD_INTERVAL):
+            self.flushHUD()
+
+    def flushHUD(self):
+        if self._hud_pending:
+            self.scene_viewer.hudInfo(hud_values=self._hud_pending)
+            self._hud_pending = {}
 
     def setHUDProperty(self,id_name, property_name, value):
         updates = { id_name : { property_name : value }}
         self.scene_viewer.hudInfo(hud_values=updates)
 
+    def beginEvent(self, event_type, kwargs = None):
+        """
+        Returns the reusable FFEvent for event_type filled from Houdini callback kwargs,
+        a new one is only allocated if the cached event is still being dispatched
+        """
+        event = self._events.get(event_type)
+        if event is None or event.in_use:
+            event = FFEvent(event_type)
+            self._events.setdefault(event_type, event)
+
+        event.in_use = True
+        event.consumed = False
+        event.ray = self.ui.ray
+        event.key = self.ui.key
+        if kwargs is not None:
+            event.kwargs = kwargs
+            event.ui_event = kwargs.get('ui_event')
+            event.parm_tuple = kwargs.get('parm_tuple')
+        return event
+
+    def endEvent(self, event):
+        event.clear()
+        event.in_use = False
+
+    def dispatchEvent(self, event_type, kwargs = None):
+        """
+        Passes an event through the whole action tree
+
+        Returns:
+            True if the event was consumed
+        """
+        event = self.beginEvent(event_type, kwargs)
+        try:
+            return self.state_action.passEvent(event_type, event)
+        finally:
+            self.endEvent(event)
+
+    def registerParm(self, ff_parm):
+        """
+        Tracks an FFParm so all actions hooking the same parm stay in sync
+        when their own writes are dropped as echoes
+        """
+        self.parms[ff_parm.name] = ff_parm
+        self._parm_copies.setdefault(ff_parm.name, []).append(ff_parm)
+
+    @contextlib.contextmanager
+    def expectEcho(self, parm, value = None):
+        """
+        Context manager around a parm write - the onParmChanged reporting the written
+        value (and the other components of the tuple unchanged) is not dispatched
+
+        Node event callbacks run synchronously inside hou.Parm.set(), so the write token
+        only lives for the duration of the block. If the write raises, FFParm copies
+        synced to the value get their previous values back.
+
+        Keyword Arguments:
+            parm (FFParm or hou.Parm) - parm that is written inside the block
+            value - written value, None matches any value (e.g. geometry data parms)
+        """
+        synced = []
+        if isinstance(parm, FFParm):
+            for copy in self._parm_copies.get(parm.name, ()):
+                if copy is not parm:
+                    synced.append((copy, copy.value, copy.dirty))
+                    copy.value = value
+                    copy.dirty = False
+            parm = parm.parm
+
+        parm_tuple = parm.tuple()
+        name = parm_tuple.name()
+        expected = {p.name(): p.eval() for p in parm_tuple if p.name() != parm.name()}
+        expected[parm.name()] = value
+        self._echoes[name] = expected
+        try:
+            yield
+        except:
+            for copy, old_value, dirty in synced:
+                copy.value = old_value
+                copy.dirty = dirty
+            raise
+        finally:
+            # a write that raised or changed nothing must not swallow the next external edit
+            self._echoes.pop(name, None)
+
+    def writeParm(self, parm, value):
+        """
+        Writes a hou.Parm outside of FFParm without undo and without
+        dispatching the resulting onParmChanged through the action tree
+        """
+        token = value if isinstance(value, (int, float, str)) else None
+        with hou.undos.disabler(), self.expectEcho(parm, token):
+            parm.set(value)
+
     def debug(self, msg, msg_type = True):
         if msg_type == True:
             if hasattr(self,'log'):
@@ -318,6 +651,102 @@ class FFState(object):
     def hookActions(self, actions):
         self._actions = actions
 
+    def enableAllocationProfiling(self, enable = True, snapshots = True, frames = 1):
+        """
+        Starts/stops tracemalloc profiling of every top-level callback
+
+        Keyword Arguments:
+            enable (bool) - Turns the profiling on/off
+            snapshots (bool) - If False only net allocations per action are collected
+            frames (int) - number of stack frames stored per allocation
+        """
+        if enable:
+            if self.alloc_profiler is None:
+                self.alloc_profiler = profiling.AllocationProfiler(frames = frames, snapshots = snapshots)
+            self.alloc_profiler.start()
+            self.debug("Allocation profiling started", Debug.PROFILE)
+        elif self.alloc_profiler is not None:
+            self.alloc_profiler.stop()
+            self.debug(self.allocationReport(), Debug.PROFILE)
+            self.alloc_profiler = None
+
+    def toggleCallbackProfiling(self, enable = None):
+        """
+        Starts/stops a cProfile capture of the state callbacks,
+        bound to PROFILE_HOTKEY. Stopping writes a .prof pstats file,
+        a .collapsed.txt file for flamegraph tools and an .info.txt with the action tree.
+
+        Keyword Arguments:
+            enable (bool) - Forces the profiling on/off, None toggles it
+
+        Returns:
+            Base path of the written capture when stopping, otherwise None
+        """
+        is_running = self.callback_profiler is not None
+        if enable is None:
+            enable = not is_running
+
+        if enable and not is_running:
+            self.callback_profiler = profiling.CallbackProfiler(self.state_name, output_dir = self.PROFILE_DIR)
+            self.callback_profiler.start()
+            self.debug("Profiling '%s' started" % self.state_name, Debug.PROFILE)
+        elif not enable and is_running:
+            profiler = self.callback_profiler
+            self.callback_profiler = None
+            base_path = profiler.stop(action_tree = self.describeActions())
+            self.debug("Profile written to %s.prof" % base_path, Debug.PROFILE)
+            return base_path
+        return None
+
+    def describeActions(self, action = None, depth = 0):
+        """
+        Returns the action tree as indented text
+        """
+        if action is None:
+            action = self.state_action
+            if action is None:
+                return ""
+
+        line = "%s%s (%s)" % ("    "*depth, action.name, type(action).__name__)
+        if getattr(action, "is_active", False):
+            line += " [active]"
+
+        lines = [line]
+        for a in action.actions:
+            lines.append(self.describeActions(a, depth + 1))
+        return "\n".join(lines)
+
+    def acquireResource(self, name, build, version = None, nbytes = None):
+        """
+        Returns a resource shared with all states working on the same node,
+        build() is only called if no state holds the resource for this version yet.
+        Acquiring a new version releases the previous one.
+
+        Keyword Arguments:
+            version - data version, e.g. a cookCount() of the source node
+            nbytes (int or callable) - size of the built value or fn(value) returning it,
+                                       estimated if not given
+        """
+        key = (self.node.path(), version, name)
+        previous = self._resource_keys.get(name)
+        value = self.resources.acquire(self, key, build, nbytes = nbytes)
+        if previous is not None and previous != key:
+            self.resources.release(self, previous)
+        self._resource_keys[name] = key
+        return value
+
+    def releaseResources(self):
+        self.resources.release(self)
+        self._resource_keys.clear()
+
+    def allocationReport(self, limit = 10):
+        """
+        Returns the top allocators per event type as text
+        """
+        if self.alloc_profiler is None:
+            return "Allocation profiling is not enabled"
+        return self.alloc_profiler.report(limit = limit)
+
     """ OVERLOAD FUNCTIONS """
 
     def onBuild(self):
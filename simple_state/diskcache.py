@@ -0,0 +1,179 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import numpy as np
+
+"""
+
+Persistent on-disk cache for acceleration data.
+Entries are keyed by a content hash of the source geometry and stored as
+one .npy file per array, so they can be memory-mapped lazily instead of being
+rebuilt every time a state is entered or Houdini restarts.
+Least recently used entries are evicted once the cache grows over its size limit.
+
+"""
+
+def geometryHash(geo, arrays = (), extra = None):
+    """
+    Content hash of a hou.Geometry - point positions plus element counts
+
+    Keyword Arguments:
+        arrays (tuple) - ndarrays derived from geo that the cached data depends on,
+                         e.g. the vertex -> point connectivity, which P and the counts don't cover
+        extra - any value that changes the cached data (e.g. build settings)
+    """
+    h = hashlib.blake2b(digest_size = 16)
+    counts = (geo.intrinsicValue("pointcount"),
+              geo.intrinsicValue("primitivecount"),
+              geo.intrinsicValue("vertexcount"))
+    h.update(repr(counts).encode())
+    h.update(geo.pointFloatAttribValuesAsString("P"))
+    for array in arrays:
+        h.update(repr((array.dtype.str, array.shape)).encode())
+        h.update(np.ascontiguousarray(array).tobytes())
+    if extra is not None:
+        h.update(repr(extra).encode())
+    return h.hexdigest()
+
+class CacheEntry:
+    """
+    Lazily memory-mapped arrays of one cache entry, arrays load on first access
+    """
+    def __init__(self, path, mmap_mode = "c"):
+        self.path = path
+        self.mmap_mode = mmap_mode
+        self._arrays = {}
+
+    def __contains__(self, name):
+        return name in self._arrays or os.path.exists(self._file(name))
+
+    def __getitem__(self, name):
+        array = self._arrays.get(name)
+        if array is None:
+            if not os.path.exists(self._file(name)):
+                raise KeyError(name)
+            array = np.load(self._file(name), mmap_mode = self.mmap_mode)
+            self._arrays[name] = array
+        return array
+
+    def _file(self, name):
+        return os.path.join(self.path, name + ".npy")
+
+    def keys(self):
+        return [f[:-4] for f in os.listdir(self.path) if f.endswith(".npy")]
+
+class DiskCache:
+    """
+    Directory of memory-mappable cache entries with LRU eviction
+
+    Example:
+        cache = DiskCache()
+        key = geometryHash(geo, extra = cell_size)
+        entry = cache.get(key, lambda: {"positions": positions, "order": order})
+        positions = entry["positions"]
+    """
+    def __init__(self, directory = None, max_bytes = 2 << 30):
+        """
+        Keyword Arguments:
+            directory (str) - cache location, defaults to $HOUDINI_TEMP_DIR/simple_state_cache
+            max_bytes (int) - total size limit, oldest entries are evicted above it
+        """
+        if directory is None:
+            temp_dir = os.environ.get("HOUDINI_TEMP_DIR") or tempfile.gettempdir()
+            directory = os.path.join(temp_dir, "simple_state_cache")
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    def _entryPath(self, key):
+        return os.path.join(self.directory, key)
+
+    def _entrySize(self, path):
+        return sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+
+    """ PUBLIC FUNCTIONS """
+
+    def has(self, key):
+        return os.path.isdir(self._entryPath(key))
+
+    def get(self, key, build = None):
+        """
+        Returns the CacheEntry for key, calling build() and storing its
+        result (dict of name: ndarray) if the key is not cached yet
+
+        Returns:
+            CacheEntry or None if the key is missing and there is no build function
+        """
+        path = self._entryPath(key)
+        if os.path.isdir(path):
+            # access time drives the LRU eviction
+            os.utime(path, None)
+            return CacheEntry(path)
+
+        if build is None:
+            return None
+        return self.put(key, build())
+
+    def put(self, key, arrays):
+        """
+        Stores a dict of arrays, the entry is written to a temporary
+        directory first so readers never see a partial entry
+        """
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+        path = self._entryPath(key)
+        tmp_path = tempfile.mkdtemp(prefix = key + ".", dir = self.directory)
+        try:
+            for name, array in arrays.items():
+                np.save(os.path.join(tmp_path, name + ".npy"), np.ascontiguousarray(array))
+            if os.path.isdir(path):
+                shutil.rmtree(tmp_path)
+            else:
+                os.replace(tmp_path, path)
+        except:
+            shutil.rmtree(tmp_path, ignore_errors = True)
+            raise
+
+        self.evict(keep = key)
+        return CacheEntry(path)
+
+    def evict(self, keep = None):
+        """
+        Removes least recently used entries until the cache fits max_bytes
+        """
+        if not os.path.isdir(self.directory):
+            return
+
+        entries = []
+        total = 0
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if not os.path.isdir(path) or "." in name:
+                continue
+            size = self._entrySize(path)
+            entries.append((os.path.getmtime(path), name, path, size))
+            total += size
+
+        entries.sort()
+        for mtime, name, path, size in entries:
+            if total <= self.max_bytes:
+                break
+            if name == keep:
+                continue
+            shutil.rmtree(path, ignore_errors = True)
+            total -= size
+
+    def clear(self):
+        if os.path.isdir(self.directory):
+            shutil.rmtree(self.directory, ignore_errors = True)
+
+    def stats(self):
+        """
+        Returns (number of entries, total bytes)
+        """
+        if not os.path.isdir(self.directory):
+            return 0, 0
+        sizes = [self._entrySize(os.path.join(self.directory, name)) for name in os.listdir(self.directory)
+            if os.path.isdir(os.path.join(self.directory, name)) and "." not in name]
+        return len(sizes), sum(sizes)
@@ -1,7 +1,16 @@
 from . import core
+from . import vmath
 from stateutils import ancestorObject
+import numpy as np
 import hou
 
+def bufferProperty(attr):
+    """
+    Property exposing a NumPy buffer, assignments are copied into the buffer in place
+    """
+    return property(lambda self: getattr(self, attr),
+                    lambda self, value: vmath.assign(getattr(self, attr), value))
+
 class FFDrawable(hou.SimpleDrawable):
     """
     Drawables for tools
@@ -19,54 +28,258 @@ class FFDrawable(hou.SimpleDrawable):
         self.setXray(True)
 
         #Editable Attributes
-        self.scale = hou.Vector3(1,1,1)
-        self.uniform_scale = 1.0
-        self.rotation = hou.Vector3()
+        #Stored in preallocated NumPy buffers, setters copy values in place
+        self._scale = vmath.vec3((1,1,1))
+        self._uniform_scale = np.ones(1)
+        self._rotation = vmath.vec3()
+
+        self._normal = vmath.vec3((0,0,1))
+        self._normal_axis = vmath.vec3((0,0,-1))
+        self._up = vmath.vec3((0,1,0))
 
-        self.normal = hou.Vector3(0,0,1)
-        self.normal_axis = hou.Vector3(0,0,-1)
-        self.up = hou.Vector3(0,1,0)
+        self._xform_np = vmath.mat4()
+        self._position = vmath.vec3()
 
-        self.xform = hou.Matrix4(1)
-        self.position = hou.Vector3()
+        #Scratch buffers reused on every update
+        self._scaled = vmath.vec3()
+        self._parts = np.empty((7,4,4))
+        self._result = vmath.mat4()
+        self._tmp = vmath.mat4()
+        self._xform = hou.Matrix4(1)
+
+    scale = bufferProperty("_scale")
+    uniform_scale = property(lambda self: float(self._uniform_scale[0]),
+                             lambda self, value: vmath.assign(self._uniform_scale, value))
+    rotation = bufferProperty("_rotation")
+    normal = bufferProperty("_normal")
+    normal_axis = bufferProperty("_normal_axis")
+    up = bufferProperty("_up")
+    position = bufferProperty("_position")
+    xform = bufferProperty("_xform_np")
 
     def update(self):
         parent = ancestorObject(self.state.node)
-        parent_xform = parent.worldTransform()
-        
-        xform_scale = hou.hmath.buildScale(self.scale*self.uniform_scale)
-        xform_rotate = hou.hmath.buildRotate(self.rotation)
+        parts = self._parts
+
+        np.multiply(self._scale, self._uniform_scale, out = self._scaled)
+        vmath.buildScale(self._scaled, parts[0])
+        vmath.buildRotate(self._rotation, parts[1])
 
-        xform_normal_axis = hou.hmath.buildRotateZToAxis(self.normal_axis)
-        xform_normal = xform_normal_axis * hou.hmath.buildRotateLookAt(hou.Vector3(0,0,0),self.normal, self.up)
+        vmath.buildRotateZToAxis(self._normal_axis, parts[2])
+        vmath.buildRotateLookAt(self._normal, self._up, parts[3])
 
-        xform = self.xform
-        xform_translate = hou.hmath.buildTranslate(self.position)
+        vmath.buildTranslate(self._position, parts[4])
+        parts[5] = self._xform_np
+        vmath.assign(parts[6], parent.worldTransform())
 
         # All attributes are applied to final transform from top to bottom
-        self._xform = xform_scale * xform_rotate * xform_normal * xform_translate  * xform * parent_xform
+        vmath.compose(parts, self._result, self._tmp)
 
-        self.setTransform(self._xform)
+        self.setTransform(vmath.toMatrix4(self._result, self._xform))
 
     def getTransform(self):
         self.update()
         return self._xform
 
+class DrawableBatch:
+    """
+    Composes the transforms of many FFDrawables in one vectorized (N,4,4) operation
+
+    Attribute buffers of added drawables are rebound as views into the batch arrays,
+    so setting drawable attributes writes straight into the batch and
+    nothing has to be gathered before an update
+    """
+    FIELDS = (
+        ("_scale", (3,)),
+        ("_uniform_scale", (1,)),
+        ("_rotation", (3,)),
+        ("_normal", (3,)),
+        ("_normal_axis", (3,)),
+        ("_up", (3,)),
+        ("_position", (3,)),
+        ("_xform_np", (4,4)),
+    )
+
+    def __init__(self):
+        self.drawables = []
+        self.arrays = {}
+        self._rebuild()
+
+    def __len__(self):
+        return len(self.drawables)
+
+    def _rebuild(self):
+        n = len(self.drawables)
+
+        for name, shape in self.FIELDS:
+            array = np.empty((n,) + shape)
+            for i, d in enumerate(self.drawables):
+                array[i] = getattr(d, name)
+                setattr(d, name, array[i])
+            self.arrays[name] = array
+
+        self._scaled = np.empty((n,3))
+        self._parts = np.empty((7,n,4,4))
+        self._result = np.empty((n,4,4))
+        self._tmp = np.empty((n,4,4))
+
+    """ PUBLIC FUNCTIONS """
+
+    def add(self, drawable):
+        if drawable not in self.drawables:
+            self.drawables.append(drawable)
+            self._rebuild()
+
+    def remove(self, drawable):
+        if drawable in self.drawables:
+            self.drawables.remove(drawable)
+            # give the drawable back its own buffers
+            for name, shape in self.FIELDS:
+                setattr(drawable, name, np.array(getattr(drawable, name)))
+            self._rebuild()
+
+    def update(self, parent_xform = None):
+        """
+        Composes and pushes transforms of all drawables in the batch
+
+        Keyword Arguments:
+            parent_xform (hou.Matrix4) - transform applied after all drawable transforms
+        """
+        if len(self.drawables) == 0:
+            return
+
+        arrays = self.arrays
+        parts = self._parts
+
+        np.multiply(arrays["_scale"], arrays["_uniform_scale"], out = self._scaled)
+        vmath.buildScale(self._scaled, parts[0])
+        vmath.buildRotate(arrays["_rotation"], parts[1])
+
+        vmath.buildRotateZToAxis(arrays["_normal_axis"], parts[2])
+        vmath.buildRotateLookAt(arrays["_normal"], arrays["_up"], parts[3])
+
+        vmath.buildTranslate(arrays["_position"], parts[4])
+        parts[5] = arrays["_xform_np"]
+
+        if parent_xform is not None:
+            vmath.assign(parts[6], parent_xform)
+        else:
+            vmath.identity(parts[6])
+
+        # All attributes are applied to final transform from top to bottom
+        vmath.compose(parts, self._result, self._tmp)
+
+        for d, xform in zip(self.drawables, self._result):
+            d.setTransform(vmath.toMatrix4(xform, d._xform))
+
+class DrawableGeometry:
+    """
+    Reusable hou.Geometry for drawables whose point attributes are mirrored in NumPy
+
+    Attribute edits only mark the touched point range dirty, push() writes the
+    dirty ranges with bulk setters and skips the drawable update when nothing changed.
+    """
+    def __init__(self, geo = None):
+        self.geo = geo if geo is not None else hou.Geometry()
+        self.attribs = {}
+        self._dirty = {}
+        self._topology_changed = True
+        self._range_writes = True
+
+    def _load(self, name):
+        values = np.frombuffer(self.geo.pointFloatAttribValuesAsString(name), dtype = np.float32).copy()
+        size = self.geo.findPointAttrib(name).size()
+        return values.reshape(-1, size)
+
+    def _writeRange(self, name, start, end):
+        values = self.attribs[name]
+        if self._range_writes:
+            try:
+                self.geo.setPointFloatAttribValuesFromString(name, values[start:end].tobytes(),
+                    hou.numericData.Float32, start)
+                return
+            except TypeError:
+                # Houdini versions without the start argument, write the whole attribute
+                self._range_writes = False
+        self.geo.setPointFloatAttribValuesFromString(name, values.tobytes())
+
+    """ PUBLIC FUNCTIONS """
+
+    def setTopology(self, geo):
+        """
+        Replaces the geometry contents, tracked attributes are reloaded
+        """
+        self.geo.clear()
+        self.geo.merge(geo)
+        for name in self.attribs:
+            self.attribs[name] = self._load(name)
+        self._dirty = {}
+        self._topology_changed = True
+
+    def attrib(self, name):
+        """
+        Returns the (N,size) float32 buffer of a point attribute,
+        call markDirty() after editing it in place
+        """
+        values = self.attribs.get(name)
+        if values is None:
+            values = self._load(name)
+            self.attribs[name] = values
+        return values
+
+    def markDirty(self, name, start = 0, end = None):
+        if end is None:
+            end = len(self.attribs[name])
+        if end <= start:
+            return
+        dirty = self._dirty.get(name)
+        if dirty is None:
+            self._dirty[name] = [start, end]
+        else:
+            dirty[0] = min(dirty[0], start)
+            dirty[1] = max(dirty[1], end)
+
+    def setValues(self, name, values, start = 0):
+        buffer = self.attrib(name)
+        end = start + len(values)
+        buffer[start:end] = values
+        self.markDirty(name, start, end)
+
+    def isDirty(self):
+        return self._topology_changed or len(self._dirty) > 0
+
+    def push(self, drawable = None):
+        """
+        Writes dirty ranges to the geometry and hands it to the drawable
+
+        Returns:
+            False if nothing changed since the last push
+        """
+        if not self.isDirty():
+            return False
+
+        for name, (start, end) in self._dirty.items():
+            self._writeRange(name, start, end)
+        self._dirty = {}
+        self._topology_changed = False
+
+        if drawable is not None:
+            drawable.setGeometry(self.geo)
+        return True
+
 class BrushDrawable:
- 
+    #Circle divisions at full quality
+    RESOLUTION = 32
+
     def __init__(self, drawable_action, name = "brush"):
         self._radius = 1.0
         self._softness = .5
         self._color = hou.Color()
-        self._position = hou.Vector3()
+        self._position = vmath.vec3()
 
-        circle_verb = box_verb = hou.sopNodeTypeCategory().nodeVerb("circle")
-        circle_verb.setParms({
-            "type": 2,
-            "arc": 1,
-        })
-        circle_geo = hou.Geometry()
-        circle_verb.execute(circle_geo, [])
+        self.resolution = self.RESOLUTION
+        self._circle_verb = hou.sopNodeTypeCategory().nodeVerb("circle")
+        circle_geo = self._buildCircle(self.resolution)
 
         self.cursor_outer = drawable_action.bindDrawable(geo = circle_geo, name = "cursor_outer")
         self.cursor_inner = drawable_action.bindDrawable(geo = circle_geo, name = "cursor_inner")
@@ -74,18 +287,39 @@ class BrushDrawable:
         self.drawables = (self.cursor_outer, self.cursor_inner)
 
         for d in self.drawables:
-            d.normal = hou.Vector3(0,1,0)
+            d.normal = (0,1,0)
             d.setDisplayMode(hou.drawableDisplayMode.WireframeMode)
 
+    def _buildCircle(self, divisions):
+        self._circle_verb.setParms({
+            "type": 2,
+            "arc": 1,
+            "divs": divisions,
+        })
+        circle_geo = hou.Geometry()
+        self._circle_verb.execute(circle_geo, [])
+        return circle_geo
+
+    def setResolution(self, divisions):
+        """
+        Rebuilds the cursor circles with a new number of divisions
+        """
+        if divisions == self.resolution:
+            return
+        self.resolution = divisions
+        circle_geo = self._buildCircle(divisions)
+        for d in self.drawables:
+            d.setGeometry(circle_geo)
+
     @property
     def position(self):
         return self._position
 
     @position.setter
     def position(self, value):
+        vmath.assign(self._position, value)
         for d in self.drawables:
-            d.position = value
-        self._position = value
+            d.position = self._position
 
     @property
     def radius(self):
@@ -94,17 +328,14 @@ class BrushDrawable:
     @radius.setter
     def radius(self, value):
         for d in self.drawables:
-            d.scale = hou.Vector3(value,value,value)
+            d.scale = value
         self._radius = value
 
     @property
     def softness(self):
         return self._softness
 
-    @radius.setter
+    @softness.setter
     def softness(self, value):
         self.drawables[1].uniform_scale = 1-value
         self._softness = value
-
-
-    
\ No newline at end of file
@@ -0,0 +1,207 @@
+import numpy as np
+import hou
+
+from . import vmath
+
+"""
+
+Bulk point insertion.
+New placements are accumulated in growable NumPy buffers and committed to
+hou.Geometry in batches - one createPoints() call plus one bulk setter per
+attribute - instead of one HOM call per point and attribute.
+
+"""
+
+def orientFromNormal(normals, up = vmath.Y_AXIS):
+    """
+    Returns (N,4) xyzw quaternions rotating 'up' onto each normal (N,3)
+    """
+    n = vmath.normalize(np.asarray(normals, dtype = np.float64))
+    w = 1.0 + n @ up
+    xyz = np.cross(up, n)
+
+    # normals opposite to up - half turn around an axis perpendicular to up
+    flipped = w < vmath.EPSILON
+    if np.any(flipped):
+        axis = vmath.X_AXIS if abs(up[0]) < 0.9 else vmath.Z_AXIS
+        xyz[flipped] = vmath.normalize(np.cross(up, axis))
+        w[flipped] = 0.0
+
+    q = np.concatenate((xyz, w[:, None]), axis = 1)
+    return vmath.normalize(q)
+
+class PointBuffer:
+    """
+    Growable structure of arrays for new point placements
+    """
+    FIELDS = (
+        ("P", (3,), np.float32),
+        ("N", (3,), np.float32),
+        ("orient", (4,), np.float32),
+        ("pscale", (), np.float32),
+        ("id", (), np.int32),
+    )
+
+    def __init__(self, capacity = 256):
+        self.count = 0
+        self.arrays = {name: np.empty((capacity,) + shape, dtype = dtype) for name, shape, dtype in self.FIELDS}
+
+    def __len__(self):
+        return self.count
+
+    def _reserve(self, count):
+        capacity = len(self.arrays["P"])
+        if count <= capacity:
+            return
+        while capacity < count:
+            capacity *= 2
+        for name, shape, dtype in self.FIELDS:
+            array = np.empty((capacity,) + shape, dtype = dtype)
+            array[:self.count] = self.arrays[name][:self.count]
+            self.arrays[name] = array
+
+    def extend(self, positions, normals, orients, scales, ids):
+        n = len(positions)
+        start = self.count
+        self._reserve(start + n)
+
+        arrays = self.arrays
+        end = start + n
+        arrays["P"][start:end] = positions
+        arrays["N"][start:end] = normals
+        arrays["orient"][start:end] = orients
+        arrays["pscale"][start:end] = scales
+        arrays["id"][start:end] = ids
+        self.count = end
+
+    def view(self, name):
+        return self.arrays[name][:self.count]
+
+    def clear(self):
+        self.count = 0
+
+class InsertionEngine:
+    """
+    Collects placements and commits them to geometry in batches of flush_size
+
+    Example:
+        engine = InsertionEngine(flush_size = 512, on_flush = self.commitGeometry)
+        engine.add(position, normal)
+        ...
+        engine.flush()
+    """
+    ATTRIB_DEFAULTS = {
+        "N": (0.0, 1.0, 0.0),
+        "orient": (0.0, 0.0, 0.0, 1.0),
+        "pscale": 1.0,
+        "id": 0,
+    }
+
+    def __init__(self, geo = None, flush_size = 512, on_flush = None):
+        """
+        Keyword Arguments:
+            geo (hou.Geometry) - writable target geometry, can be set later with setGeometry()
+            flush_size (int) - number of pending placements that triggers a commit
+            on_flush (callable) - called with the target geometry after every commit
+        """
+        self.flush_size = flush_size
+        self.on_flush = on_flush
+        self.pending = PointBuffer()
+        self.next_id = 0
+        self.geo = None
+        self._range_writes = True
+
+        if geo is not None:
+            self.setGeometry(geo)
+
+    def _writeTail(self, name, values, start):
+        """
+        Writes values to the points from start on in one bulk call,
+        only the new points are written
+        """
+        geo = self.geo
+        is_int = values.dtype == np.int32
+        if self._range_writes:
+            try:
+                if is_int:
+                    geo.setPointIntAttribValuesFromString(name, values.tobytes(), hou.numericData.Int32, start)
+                else:
+                    geo.setPointFloatAttribValuesFromString(name, values.tobytes(), hou.numericData.Float32, start)
+                return
+            except TypeError:
+                # Houdini versions without the start argument, rewrite the whole attribute
+                self._range_writes = False
+
+        offset = start * (values.size // len(values))
+        if is_int:
+            current = np.frombuffer(geo.pointIntAttribValuesAsString(name), dtype = np.int32).copy()
+            current[offset:] = values.ravel()
+            geo.setPointIntAttribValuesFromString(name, current.tobytes())
+        else:
+            current = np.frombuffer(geo.pointFloatAttribValuesAsString(name), dtype = np.float32).copy()
+            current[offset:] = values.ravel()
+            geo.setPointFloatAttribValuesFromString(name, current.tobytes())
+
+    """ PUBLIC FUNCTIONS """
+
+    def setGeometry(self, geo):
+        """
+        Sets the writable target geometry and continues ids after its highest id
+        """
+        self.geo = geo
+        for name, default in self.ATTRIB_DEFAULTS.items():
+            if geo.findPointAttrib(name) is None:
+                geo.addAttrib(hou.attribType.Point, name, default)
+
+        ids = np.frombuffer(geo.pointIntAttribValuesAsString("id"), dtype = np.int32)
+        self.next_id = int(ids.max()) + 1 if len(ids) > 0 else 0
+
+    def add(self, position, normal, orient = None, scale = 1.0):
+        self.addMany(np.reshape(position, (1,3)), np.reshape(normal, (1,3)),
+            None if orient is None else np.reshape(orient, (1,4)), scale)
+
+    def addMany(self, positions, normals, orients = None, scales = 1.0):
+        """
+        Queues placements, orient defaults to rotating +Y onto the normal
+        """
+        n = len(positions)
+        if n == 0:
+            return
+        if orients is None:
+            orients = orientFromNormal(normals)
+
+        ids = np.arange(self.next_id, self.next_id + n, dtype = np.int32)
+        self.next_id += n
+
+        self.pending.extend(positions, normals, orients, scales, ids)
+
+        if len(self.pending) >= self.flush_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Commits all pending placements to the target geometry
+
+        Returns:
+            Number of committed points
+        """
+        count = len(self.pending)
+        if count == 0 or self.geo is None:
+            return 0
+
+        geo = self.geo
+        start = geo.intrinsicValue("pointcount")
+        geo.createPoints(self.pending.view("P").tolist())
+
+        for name in self.ATTRIB_DEFAULTS:
+            self._writeTail(name, self.pending.view(name), start)
+
+        self.pending.clear()
+
+        if self.on_flush is not None:
+            self.on_flush(geo)
+        return count
+
+    def discard(self):
+        self.next_id -= len(self.pending)
+        self.pending.clear()
@@ -0,0 +1,184 @@
+import numpy as np
+
+from . import vmath
+
+"""
+
+Screen-space picking helpers.
+Candidate points are projected to viewport pixels once per view/geometry change
+and bucketed into a 2D grid, so hover queries on mouse move only look at
+the few grid cells around the cursor.
+
+"""
+
+def readPositions(geo, attrib = "P"):
+    """
+    Reads a point vector attribute as a (N,3) float32 array in one bulk call
+    """
+    data = geo.pointFloatAttribValuesAsString(attrib)
+    return np.frombuffer(data, dtype = np.float32).reshape(-1, 3)
+
+def viewportProjection(viewport, xform = None):
+    """
+    Returns a (4,4) row-vector matrix mapping positions to viewport pixels
+    (before the perspective divide)
+
+    Keyword Arguments:
+        xform (hou.Matrix4) - object to world transform of the projected geometry
+    """
+    world_to_camera = viewport.cameraToModelTransform().inverted()
+    camera_to_ndc = viewport.ndcToCameraTransform().inverted()
+    ndc_to_viewport = viewport.viewportToNDCTransform().inverted()
+
+    projection = world_to_camera * camera_to_ndc * ndc_to_viewport
+    if xform is not None:
+        projection = xform * projection
+    return vmath.mat4(projection)
+
+class ScreenPointCache:
+    """
+    Projected point positions bucketed into a screen-space grid
+
+    update() reprojects only when the view or the geometry version changed,
+    nearest()/hover()/query() are cheap enough to call on every mouse move.
+    """
+    def __init__(self, cell_size = 16):
+        """
+        Keyword Arguments:
+            cell_size (int) - size of the grid cells in pixels
+        """
+        self.cell_size = cell_size
+
+        self.positions = np.empty((0,3), dtype = np.float32)
+        self.version = None
+
+        # Projected data
+        self.screen = np.empty((0,2))
+        self.depth = np.empty(0)
+        self.visible = np.empty(0, dtype = bool)
+
+        # Grid - point indices sorted by cell, cell_start[c]:cell_start[c+1] is cell c
+        self._order = np.empty(0, dtype = np.int64)
+        self._cell_start = np.zeros(1, dtype = np.int64)
+        self._grid_size = (0, 0)
+
+        self._view_key = None
+        self.is_dirty = True
+
+    def _viewKey(self, viewport):
+        return (viewport.cameraToModelTransform().asTuple(),
+                viewport.ndcToCameraTransform().asTuple(),
+                tuple(viewport.size()))
+
+    def _project(self, viewport, xform):
+        projection = viewportProjection(viewport, xform)
+        positions = self.positions
+
+        h = positions @ projection[:3] + projection[3]
+        w = h[:, 3]
+        self.visible = w > vmath.EPSILON
+        self.screen = h[:, :2] / np.where(self.visible, w, 1.0)[:, None]
+        self.depth = w
+
+        # viewport pixel coordinates, same space as mouseX()/mouseY()
+        width, height = viewport.size()[2:]
+        inside = self.visible & (self.screen[:, 0] >= 0) & (self.screen[:, 0] < width) \
+            & (self.screen[:, 1] >= 0) & (self.screen[:, 1] < height)
+        self._buildGrid(np.nonzero(inside)[0], width, height)
+
+    def _buildGrid(self, indices, width, height):
+        nx = int(width // self.cell_size) + 1
+        ny = int(height // self.cell_size) + 1
+        self._grid_size = (nx, ny)
+
+        cells = self._cellIds(self.screen[indices])
+        order = np.argsort(cells, kind = "stable")
+        self._order = indices[order]
+        self._cell_start = np.searchsorted(cells[order], np.arange(nx*ny + 1))
+
+    def _cellIds(self, screen):
+        nx, ny = self._grid_size
+        ix = np.clip((screen[:, 0] // self.cell_size).astype(np.int64), 0, nx - 1)
+        iy = np.clip((screen[:, 1] // self.cell_size).astype(np.int64), 0, ny - 1)
+        return iy*nx + ix
+
+    def _candidates(self, x, y, radius):
+        nx, ny = self._grid_size
+        if nx == 0:
+            return self._order[:0]
+
+        r = int(np.ceil(radius / self.cell_size))
+        cx = int(x // self.cell_size)
+        cy = int(y // self.cell_size)
+
+        x0, x1 = max(cx - r, 0), min(cx + r, nx - 1)
+        y0, y1 = max(cy - r, 0), min(cy + r, ny - 1)
+        if x0 > x1 or y0 > y1:
+            return self._order[:0]
+
+        # cells of one grid row are contiguous in the sorted order
+        starts = self._cell_start
+        chunks = [self._order[starts[iy*nx + x0]:starts[iy*nx + x1 + 1]] for iy in range(y0, y1 + 1)]
+        return np.concatenate(chunks)
+
+    """ PUBLIC FUNCTIONS """
+
+    def setPoints(self, positions, version = None):
+        """
+        Sets candidate positions (N,3), version is any value that changes
+        when the geometry recooks (e.g. node.cookCount())
+        """
+        self.positions = positions
+        self.version = version
+        self.invalidate()
+
+    def setGeometry(self, geo, version = None, attrib = "P"):
+        if version is None or version != self.version:
+            self.setPoints(readPositions(geo, attrib), version)
+
+    def invalidate(self):
+        self.is_dirty = True
+
+    def update(self, viewport, xform = None):
+        """
+        Reprojects points if the view changed since the last update
+
+        Keyword Arguments:
+            xform (hou.Matrix4) - object to world transform of the points
+        """
+        view_key = self._viewKey(viewport)
+        if xform is not None:
+            view_key += (xform.asTuple(),)
+
+        if self.is_dirty or view_key != self._view_key:
+            self._project(viewport, xform)
+            self._view_key = view_key
+            self.is_dirty = False
+
+    def query(self, x, y, radius):
+        """
+        Returns indices of all points within radius pixels of (x, y)
+        """
+        candidates = self._candidates(x, y, radius)
+        offset = self.screen[candidates] - (x, y)
+        inside = np.einsum("ij,ij->i", offset, offset) <= radius*radius
+        return candidates[inside]
+
+    def nearest(self, x, y, radius):
+        """
+        Returns (index, distance) of the point nearest to (x, y) within radius pixels,
+        index is -1 if there is none. Ties are resolved towards the camera.
+        """
+        candidates = self._candidates(x, y, radius)
+        if len(candidates) == 0:
+            return -1, None
+
+        offset = self.screen[candidates] - (x, y)
+        dist2 = np.einsum("ij,ij->i", offset, offset)
+        best = np.lexsort((self.depth[candidates], dist2))[0]
+        if dist2[best] > radius*radius:
+            return -1, None
+        return int(candidates[best]), float(np.sqrt(dist2[best]))
+
+    def hover(self, x, y, radius = 10):
+        return self.nearest(x, y, radius)[0]
@@ -0,0 +1,218 @@
+import numpy as np
+import hou
+
+from .drawable import DrawableGeometry
+
+"""
+
+Live previews evaluated with SOP verbs.
+Instead of writing parms and waiting for the whole HDA to cook, a preview runs
+only the relevant verbs on cached input geometry and shows the result through
+a drawable. The real parm commit happens once the interaction ends
+(see FFParm.defer()). InstancedPreview keeps one geometry alive and only
+rewrites the points that changed (see drawable.DrawableGeometry).
+
+"""
+
+class VerbStep:
+    """
+    One SOP verb of a preview chain
+    """
+    def __init__(self, verb, parms = None, inputs = (None,)):
+        """
+        Keyword Arguments:
+            verb (str, hou.SopVerb or hou.SopNode) - verb name, verb or a node whose verb and parms are used
+            parms (dict) - parm overrides
+            inputs (tuple) - input geometries, None is replaced with the output of the previous step
+        """
+        if isinstance(verb, str):
+            verb = hou.sopNodeTypeCategory().nodeVerb(verb)
+        elif isinstance(verb, hou.SopNode):
+            node = verb
+            verb = node.verb()
+            verb.loadParmsFromNode(node)
+
+        self.verb = verb
+        self.inputs = tuple(inputs)
+        self.output = hou.Geometry()
+
+        if parms is not None:
+            self.verb.setParms(parms)
+
+    def execute(self, previous):
+        inputs = [previous if geo is None else geo for geo in self.inputs]
+        self.verb.execute(self.output, inputs)
+        return self.output
+
+class VerbPreview:
+    """
+    Chain of VerbSteps evaluated on cached geometry and shown through an FFDrawable
+
+    Example:
+        self.preview = VerbPreview(self.bindDrawable(geo = hou.Geometry(), name = "preview"))
+        self.preview.addStep(copy_node, inputs = (VerbPreview.cacheInput(copy_node), None))
+        ...
+        self.preview.show(points_geo)
+    """
+    def __init__(self, drawable = None):
+        self.drawable = drawable
+        self.steps = []
+        self.input_geo = None
+        self.is_dirty = True
+
+    @staticmethod
+    def cacheInput(node, index = 0):
+        """
+        Returns a frozen copy of the geometry connected to a node input,
+        so the preview does not cook the network again
+        """
+        input_node = node.input(index)
+        if input_node is None:
+            return None
+        return input_node.geometry().freeze()
+
+    """ PUBLIC FUNCTIONS """
+
+    def addStep(self, verb, parms = None, inputs = (None,)):
+        step = VerbStep(verb, parms = parms, inputs = inputs)
+        self.steps.append(step)
+        self.is_dirty = True
+        return step
+
+    def setParms(self, step_index, parms):
+        self.steps[step_index].verb.setParms(parms)
+        self.is_dirty = True
+
+    def setInput(self, geo):
+        self.input_geo = geo
+        self.is_dirty = True
+
+    def evaluate(self, geo = None):
+        """
+        Runs the verb chain on geo (or the last input) and returns the output geometry
+        """
+        if geo is not None:
+            self.setInput(geo)
+
+        output = self.input_geo
+        if self.is_dirty:
+            for step in self.steps:
+                output = step.execute(output)
+            self.is_dirty = False
+        elif len(self.steps) > 0:
+            output = self.steps[-1].output
+        return output
+
+    def show(self, geo = None):
+        output = self.evaluate(geo)
+        if self.drawable is not None and output is not None:
+            self.drawable.setGeometry(output)
+            self.drawable.show(True)
+        return output
+
+    def hide(self):
+        if self.drawable is not None:
+            self.drawable.show(False)
+
+def rotateByQuaternion(vectors, quaternions):
+    """
+    Rotates vectors (...,3) by xyzw quaternions (...,4)
+    """
+    q = quaternions[..., :3]
+    w = quaternions[..., 3:4]
+    t = 2.0 * np.cross(q, vectors)
+    return vectors + w*t + np.cross(q, t)
+
+class InstancedPreview(DrawableGeometry):
+    """
+    Preview of proxy geometry copied onto points, updated by diffs
+
+    Topology for 'capacity' copies is built once by a VerbPreview chain that
+    copies proxy_geo onto points - the copytopoints verb by default, or the
+    copy verbs of the HDA itself. Unused copies are collapsed to a point.
+    Appending instances only rewrites P of the new copies, so the update cost
+    follows the brush, not the layout.
+    """
+    def __init__(self, proxy_geo, capacity = 256, chain = None):
+        """
+        Keyword Arguments:
+            chain (VerbPreview) - verbs copying proxy_geo onto the points of their input geometry
+        """
+        super().__init__()
+        self.proxy_geo = proxy_geo
+        self.proxy_positions = np.frombuffer(proxy_geo.pointFloatAttribValuesAsString("P"),
+            dtype = np.float32).reshape(-1, 3)
+        self.count = 0
+        self.capacity = 0
+
+        if chain is None:
+            chain = VerbPreview()
+            chain.addStep("copytopoints::2.0", inputs = (proxy_geo, None))
+        self.chain = chain
+
+        self.instances = np.empty((0, 8), dtype = np.float32)
+        self._reserve(capacity)
+
+    def _reserve(self, capacity):
+        if capacity <= self.capacity:
+            return
+        capacity = max(capacity, self.capacity * 2)
+
+        points = hou.Geometry()
+        points.createPoints([(0.0, 0.0, 0.0)] * capacity)
+        copies = self.chain.evaluate(points)
+        if copies.intrinsicValue("pointcount") != capacity * len(self.proxy_positions):
+            # packed copies have one point per copy, they are only moved
+            self.proxy_positions = np.zeros((1, 3), dtype = np.float32)
+        self.setTopology(copies)
+
+        instances = np.zeros((capacity, 8), dtype = np.float32)
+        instances[:self.count] = self.instances[:self.count]
+        self.instances = instances
+        self.capacity = capacity
+
+        positions = self.attrib("P")
+        positions[:] = 0.0
+        self.markDirty("P")
+        self._updateCopies(0, self.count)
+
+    def _updateCopies(self, start, end):
+        if end <= start:
+            return
+        k = len(self.proxy_positions)
+        instances = self.instances[start:end]
+
+        rotated = rotateByQuaternion(self.proxy_positions[None, :, :] * instances[:, None, 7:8],
+            instances[:, None, 3:7])
+        copies = rotated + instances[:, None, 0:3]
+
+        self.setValues("P", copies.reshape(-1, 3), start * k)
+
+    """ PUBLIC FUNCTIONS """
+
+    def append(self, positions, orients, scales = 1.0):
+        """
+        Adds instances (positions (N,3), xyzw orients (N,4), scales)
+        """
+        n = len(positions)
+        if n == 0:
+            return
+        start = self.count
+        self._reserve(start + n)
+
+        instances = self.instances[start:start + n]
+        instances[:, 0:3] = positions
+        instances[:, 3:7] = orients
+        instances[:, 7] = scales
+        self.count = start + n
+
+        self._updateCopies(start, self.count)
+
+    def clear(self):
+        """
+        Collapses all used copies
+        """
+        if self.count > 0:
+            k = len(self.proxy_positions)
+            self.setValues("P", np.zeros((self.count * k, 3), dtype = np.float32), 0)
+            self.count = 0
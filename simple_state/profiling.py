@@ -0,0 +1,266 @@
+import cProfile
+import os
+import pstats
+import re
+import tempfile
+import time
+import tracemalloc
+
+"""
+
+Profiling helpers for FFState.
+Profilers are attached to a state and driven from the top-level
+Houdini callbacks, so they only see work done inside the state's event loop.
+
+"""
+
+class AllocationProfiler:
+    """
+    tracemalloc based allocation profiler
+
+    Takes a snapshot before and after every top-level callback and aggregates
+    the difference by file/line per event type. Net allocations of every
+    action are collected from _executeEvent and aggregated per event type as well.
+    """
+    def __init__(self, frames = 1, snapshots = True):
+        """
+        Keyword Arguments:
+            frames (int) - number of frames tracemalloc stores per allocation
+            snapshots (bool) - If False only per action totals are collected (much cheaper)
+        """
+        self.frames = frames
+        self.snapshots = snapshots
+        self.is_running = False
+        self._started_tracing = False
+
+        self._snapshot = None
+        self._event_type = None
+        self._filters = (
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, __file__),
+        )
+
+        self.reset()
+
+    def reset(self):
+        # event_type : { (filename, lineno) : [size, count] }
+        self.lines = {}
+        # event_type : { action_name : [size, calls] }
+        self.actions = {}
+        # event_type : number of captured callbacks
+        self.events = {}
+
+    def start(self):
+        if self.is_running:
+            return
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+            self._started_tracing = True
+        self.is_running = True
+
+    def stop(self):
+        if not self.is_running:
+            return
+        self.is_running = False
+        self._snapshot = None
+        self._event_type = None
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+    def begin(self, event_type):
+        """
+        Called at the start of a top-level callback
+        """
+        if not self.is_running or self._event_type is not None:
+            return
+        self._event_type = event_type
+        if self.snapshots:
+            self._snapshot = tracemalloc.take_snapshot().filter_traces(self._filters)
+
+    def end(self, event_type):
+        """
+        Called at the end of a top-level callback
+        """
+        if not self.is_running or self._event_type != event_type:
+            return
+
+        self.events[event_type] = self.events.get(event_type, 0) + 1
+
+        if self._snapshot is not None:
+            snapshot = tracemalloc.take_snapshot().filter_traces(self._filters)
+            lines = self.lines.setdefault(event_type, {})
+
+            for stat in snapshot.compare_to(self._snapshot, "lineno"):
+                if stat.size_diff <= 0:
+                    continue
+                frame = stat.traceback[0]
+                key = (frame.filename, frame.lineno)
+                entry = lines.get(key)
+                if entry is None:
+                    lines[key] = [stat.size_diff, stat.count_diff]
+                else:
+                    entry[0] += stat.size_diff
+                    entry[1] += stat.count_diff
+
+        self._snapshot = None
+        self._event_type = None
+
+    def actionBegin(self):
+        return tracemalloc.get_traced_memory()[0]
+
+    def actionEnd(self, action_name, event_type, start):
+        size = tracemalloc.get_traced_memory()[0] - start
+        actions = self.actions.setdefault(event_type, {})
+        entry = actions.get(action_name)
+        if entry is None:
+            actions[action_name] = [size, 1]
+        else:
+            entry[0] += size
+            entry[1] += 1
+
+    def report(self, limit = 10):
+        """
+        Returns a text report of the top allocators per event type
+        """
+        out = []
+        for event_type in sorted(self.events):
+            calls = self.events[event_type]
+            out.append("%s (%d calls)" % (event_type, calls))
+
+            lines = self.lines.get(event_type, {})
+            top_lines = sorted(lines.items(), key = lambda x: x[1][0], reverse = True)[:limit]
+            for (filename, lineno), (size, count) in top_lines:
+                out.append("    %10.1f KiB %8d blocks  %s:%d" % (size/1024.0, count, filename, lineno))
+
+            actions = self.actions.get(event_type, {})
+            top_actions = sorted(actions.items(), key = lambda x: x[1][0], reverse = True)[:limit]
+            for name, (size, action_calls) in top_actions:
+                out.append("    %10.1f KiB net %6d calls  action %s" % (size/1024.0, action_calls, name))
+
+        return "\n".join(out)
+
+class CallbackProfiler:
+    """
+    cProfile session scoped to the top-level callbacks of a state
+
+    The profiler is only enabled while a callback runs, so idle time
+    between Houdini events does not show up in the capture.
+    """
+    def __init__(self, state_name, output_dir = None):
+        """
+        Keyword Arguments:
+            state_name (str) - used as a tag in file names and as the root stack frame
+            output_dir (str) - directory for captures, defaults to $HOUDINI_TEMP_DIR/simple_state_profiles
+        """
+        self.state_name = state_name
+        if output_dir is None:
+            temp_dir = os.environ.get("HOUDINI_TEMP_DIR") or tempfile.gettempdir()
+            output_dir = os.path.join(temp_dir, "simple_state_profiles")
+        self.output_dir = output_dir
+
+        self.profile = None
+        self.is_running = False
+
+    def start(self):
+        if self.is_running:
+            return
+        self.profile = cProfile.Profile()
+        self.is_running = True
+
+    def stop(self, action_tree = None):
+        """
+        Stops the capture and writes it to disk
+
+        Returns:
+            Base path of the written files (.prof, .collapsed.txt, .info.txt)
+        """
+        if not self.is_running:
+            return None
+        self.is_running = False
+        self.profile.disable()
+
+        base_path = self.write(action_tree)
+        self.profile = None
+        return base_path
+
+    def begin(self):
+        if self.is_running:
+            self.profile.enable()
+
+    def end(self):
+        if self.is_running:
+            self.profile.disable()
+
+    def write(self, action_tree = None):
+        if not os.path.isdir(self.output_dir):
+            os.makedirs(self.output_dir)
+
+        name = re.sub(r"[^\w.-]", "_", self.state_name)
+        stamp = time.strftime("%Y%m%d_%H%M%S")
+        base_path = os.path.join(self.output_dir, "%s_%s" % (name, stamp))
+
+        self.profile.dump_stats(base_path + ".prof")
+
+        stats = pstats.Stats(self.profile)
+        with open(base_path + ".collapsed.txt", "w") as f:
+            for stack, value in collapseStats(stats, root = name):
+                f.write("%s %d\n" % (stack, value))
+
+        with open(base_path + ".info.txt", "w") as f:
+            f.write("state: %s\n" % self.state_name)
+            f.write("captured: %s\n" % time.strftime("%Y-%m-%d %H:%M:%S"))
+            if action_tree is not None:
+                f.write("actions:\n%s\n" % action_tree)
+
+        return base_path
+
+def collapseStats(stats, root = None, max_depth = 64):
+    """
+    Converts pstats call graph to collapsed stacks (frame;frame;frame value)
+    usable by flamegraph tools. Values are microseconds.
+
+    pstats only stores caller/callee pairs, so time of functions with several
+    callers is split between the stacks proportionally to each call edge.
+    """
+    entries = stats.stats
+
+    callees = {}
+    for func, (cc, nc, tt, ct, callers) in entries.items():
+        for caller, edge in callers.items():
+            callees.setdefault(caller, []).append((func, edge[3]))
+
+    def label(func):
+        filename, lineno, name = func
+        if filename == "~":
+            return name
+        return "%s:%d:%s" % (os.path.basename(filename), lineno, name)
+
+    out = {}
+
+    def walk(func, weight, path, depth):
+        cc, nc, tt, ct, callers = entries[func]
+        path = path + (label(func),)
+
+        self_time = tt * weight
+        if self_time > 0:
+            key = ";".join(path)
+            out[key] = out.get(key, 0.0) + self_time
+
+        if depth >= max_depth:
+            return
+        for child, edge_time in callees.get(func, ()):
+            child_total = entries[child][3]
+            if child_total <= 0 or label(child) in path:
+                continue
+            walk(child, weight * edge_time / child_total, path, depth + 1)
+
+    start = (root,) if root is not None else ()
+    for func, (cc, nc, tt, ct, callers) in entries.items():
+        if not callers:
+            walk(func, 1.0, start, 0)
+
+    for stack, seconds in sorted(out.items()):
+        value = int(round(seconds * 1e6))
+        if value > 0:
+            yield stack, value
@@ -0,0 +1,113 @@
+import time
+
+"""
+
+Adaptive quality for interactive callbacks.
+FFState measures every top-level callback and feeds the durations to a
+QualityController. Sustained overruns of the latency budget raise the
+quality level (0 = full quality), headroom lowers it again. Actions react in
+FFAction.qualityChanged() by trimming optional work - cursor resolution,
+sample counts, HUD updates, refresh rate.
+
+"""
+
+class QualityController:
+    """
+    Latency budget tracker with hysteresis between quality levels
+
+    Example:
+        if state.quality.allow("hud", 0.1):
+            ...
+        samples = state.quality.scale(512, 64)
+    """
+    # one-off or self-budgeted callbacks don't count as interaction latency
+    IGNORED = ("onEnter", "onExit", "onResume", "onInterrupt", "onIdle")
+
+    def __init__(self, budget = 1.0/30.0, max_level = 3, overrun_count = 4, recover_count = 30,
+                 headroom = 0.5, on_change = None):
+        """
+        Keyword Arguments:
+            budget (float) - seconds a top-level callback may take
+            max_level (int) - lowest quality level
+            overrun_count (int) - consecutive overruns that lower the quality one level
+            recover_count (int) - consecutive callbacks under budget*headroom that raise it one level
+            headroom (float) - fraction of the budget that counts as headroom
+            on_change (callable) - called with the new level
+        """
+        self.budget = budget
+        self.max_level = max_level
+        self.overrun_count = overrun_count
+        self.recover_count = recover_count
+        self.headroom = headroom
+        self.on_change = on_change
+
+        self.level = 0
+        self.average = 0.0
+        self._overruns = 0
+        self._fast = 0
+        self._last_allowed = {}
+
+    def _setLevel(self, level):
+        level = min(max(level, 0), self.max_level)
+        self._overruns = 0
+        self._fast = 0
+        if level != self.level:
+            self.level = level
+            if self.on_change is not None:
+                self.on_change(level)
+
+    """ PUBLIC FUNCTIONS """
+
+    def measure(self, event_type, duration):
+        """
+        Records the duration in seconds of one top-level callback
+        """
+        if self.budget is None or event_type in self.IGNORED:
+            return
+
+        self.average += (duration - self.average) * 0.2
+
+        if duration > self.budget:
+            self._overruns += 1
+            self._fast = 0
+            if self._overruns >= self.overrun_count and self.level < self.max_level:
+                self._setLevel(self.level + 1)
+        elif duration < self.budget * self.headroom:
+            self._fast += 1
+            self._overruns = 0
+            if self._fast >= self.recover_count and self.level > 0:
+                self._setLevel(self.level - 1)
+        else:
+            self._overruns = 0
+            self._fast = 0
+
+    def reset(self):
+        self._last_allowed.clear()
+        self.average = 0.0
+        self._setLevel(0)
+
+    def factor(self):
+        """
+        Returns 1.0 at full quality down to 0.0 at the lowest level
+        """
+        return 1.0 - self.level / float(self.max_level) if self.max_level > 0 else 1.0
+
+    def scale(self, full, lowest):
+        """
+        Interpolates a setting between its full quality and lowest quality value
+        """
+        value = lowest + (full - lowest) * self.factor()
+        return int(round(value)) if isinstance(full, int) and isinstance(lowest, int) else value
+
+    def allow(self, name, interval):
+        """
+        Throttles optional work - always True at full quality,
+        otherwise True at most once per interval*level seconds for each name
+        """
+        if self.level == 0:
+            return True
+        now = time.perf_counter()
+        if now - self._last_allowed.get(name, 0.0) < interval * self.level:
+            return False
+        self._last_allowed[name] = now
+        return True
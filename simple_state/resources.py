@@ -0,0 +1,208 @@
+import collections
+import time
+import numpy as np
+
+"""
+
+Process-wide sharing of heavy, immutable state data.
+Every FFState instance (one per scene viewer) acquires resources through the
+shared 'manager' by key - usually (node path, data version, name) - so the same
+tool running in several panes builds collision data or caches only once.
+Resources are refcounted per owner, unreferenced ones stay cached until the
+memory budget is exceeded and are then evicted least recently used first.
+
+"""
+
+def estimateSize(value, _seen = None):
+    """
+    Rough memory size in bytes of NumPy arrays held by value.
+    Objects can report their own size with an 'nbytes' attribute, memory-mapped
+    arrays are only counted that way (e.g. TriangleGrid.nbytes)
+    """
+    if _seen is None:
+        _seen = set()
+    if id(value) in _seen:
+        return 0
+    _seen.add(id(value))
+
+    if isinstance(value, np.memmap):
+        return 0
+    if not isinstance(value, np.ndarray) and isinstance(getattr(value, "nbytes", None), int):
+        return value.nbytes
+    if isinstance(value, np.ndarray):
+        return value.nbytes if value.base is None else 0
+    if isinstance(value, dict):
+        return sum(estimateSize(v, _seen) for v in value.values())
+    if isinstance(value, (list, tuple, set)):
+        return sum(estimateSize(v, _seen) for v in value)
+    if hasattr(value, "intrinsicValue"):
+        try:
+            return int(value.intrinsicValue("memoryusage"))
+        except Exception:
+            return 0
+    if hasattr(value, "__dict__"):
+        return estimateSize(vars(value), _seen)
+    return 0
+
+class Resource:
+    __slots__ = ("key", "value", "nbytes", "owners", "last_used")
+
+    def __init__(self, key, value, nbytes):
+        self.key = key
+        self.value = value
+        self.nbytes = nbytes
+        self.owners = set()
+        self.last_used = time.time()
+
+class ResourceManager:
+    """
+    Refcounted resource cache with a global memory budget
+
+    Example:
+        grid = manager.acquire(state, (node.path(), node.cookCount(), "grid"), buildGrid)
+        ...
+        manager.release(state)
+    """
+    def __init__(self, budget = 1 << 30):
+        """
+        Keyword Arguments:
+            budget (int) - bytes unreferenced resources may occupy before they are evicted
+        """
+        self.budget = budget
+        self._resources = collections.OrderedDict()
+        self._owned = {}
+        self.nbytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __contains__(self, key):
+        return key in self._resources
+
+    def _touch(self, resource):
+        resource.last_used = time.time()
+        self._resources.move_to_end(resource.key)
+
+    """ PUBLIC FUNCTIONS """
+
+    def acquire(self, owner, key, build, nbytes = None):
+        """
+        Returns the resource for key, calling build() if it is not cached,
+        owner holds one reference until release()
+
+        Keyword Arguments:
+            nbytes (int or callable) - size of the built value or fn(value) returning it,
+                                       estimated if not given
+        """
+        resource = self._resources.get(key)
+        if resource is None:
+            self.misses += 1
+            value = build()
+            if nbytes is None:
+                size = estimateSize(value)
+            else:
+                size = nbytes(value) if callable(nbytes) else nbytes
+            resource = Resource(key, value, size)
+            self._resources[key] = resource
+            self.nbytes += resource.nbytes
+        else:
+            self.hits += 1
+            self._touch(resource)
+
+        resource.owners.add(owner)
+        self._owned.setdefault(owner, set()).add(key)
+
+        self.evict()
+        return resource.value
+
+    def get(self, key):
+        """
+        Returns a cached value without taking a reference, None if missing
+        """
+        resource = self._resources.get(key)
+        if resource is None:
+            return None
+        self._touch(resource)
+        return resource.value
+
+    def release(self, owner, key = None):
+        """
+        Drops the reference of owner on key, or on all of its resources
+        """
+        keys = self._owned.get(owner)
+        if not keys:
+            return
+        released = list(keys) if key is None else [key] if key in keys else []
+        for k in released:
+            keys.discard(k)
+            resource = self._resources.get(k)
+            if resource is not None:
+                resource.owners.discard(owner)
+        if not keys:
+            del self._owned[owner]
+
+        self.evict()
+
+    def refcount(self, key):
+        resource = self._resources.get(key)
+        return 0 if resource is None else len(resource.owners)
+
+    def evict(self):
+        """
+        Removes unreferenced resources, least recently used first, until the budget is met
+        """
+        if self.nbytes <= self.budget:
+            return
+        for key in list(self._resources):
+            if self.nbytes <= self.budget:
+                break
+            resource = self._resources[key]
+            if resource.owners:
+                continue
+            del self._resources[key]
+            self.nbytes -= resource.nbytes
+            self.evictions += 1
+
+    def invalidate(self, match):
+        """
+        Removes unreferenced resources whose key matches match(key), e.g. older data versions
+        """
+        for key in [k for k, r in self._resources.items() if not r.owners and match(k)]:
+            self.nbytes -= self._resources.pop(key).nbytes
+
+    def clear(self):
+        """
+        Removes all unreferenced resources
+        """
+        self.invalidate(lambda key: True)
+
+    def stats(self):
+        """
+        Returns a dict with counts, memory use and hit/miss/eviction counters
+        """
+        return {
+            "resources": len(self._resources),
+            "referenced": sum(1 for r in self._resources.values() if r.owners),
+            "owners": len(self._owned),
+            "bytes": self.nbytes,
+            "budget": self.budget,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+    def report(self):
+        """
+        Returns the stats and the cached resources as text
+        """
+        stats = self.stats()
+        lines = ["%d resources (%d referenced, %d owners), %.1f / %.1f MB, %d hits, %d misses, %d evictions" % (
+            stats["resources"], stats["referenced"], stats["owners"], stats["bytes"] / 1e6,
+            stats["budget"] / 1e6, stats["hits"], stats["misses"], stats["evictions"])]
+        for resource in reversed(self._resources.values()):
+            lines.append("  %8.2f MB  refs %d  %s" % (resource.nbytes / 1e6, len(resource.owners), resource.key))
+        return "\n".join(lines)
+
+# shared by all states of this Houdini session
+manager = ResourceManager()
@@ -0,0 +1,306 @@
+import numpy as np
+
+from . import vmath
+
+"""
+
+Incremental Poisson-disk scattering.
+Points are kept in a NumPy spatial hash (open addressing + per cell linked lists),
+so inserting points and rejecting candidates costs the same no matter how many
+points the layout already contains.
+
+"""
+
+EMPTY = np.int64(-1)
+
+def falloff(distance, radius, softness):
+    """
+    Brush weight - 1 inside radius*(1-softness), smooth falloff to 0 at radius
+    """
+    inner = radius * (1.0 - softness)
+    if radius - inner < vmath.EPSILON:
+        return (distance <= radius).astype(np.float64)
+    t = np.clip((radius - distance) / (radius - inner), 0.0, 1.0)
+    return t*t*(3.0 - 2.0*t)
+
+def tangentBasis(normal):
+    """
+    Returns two unit vectors perpendicular to normal
+    """
+    n = vmath.normalize(np.asarray(normal, dtype = np.float64))
+    helper = vmath.X_AXIS if abs(n[0]) < 0.9 else vmath.Y_AXIS
+    t1 = vmath.normalize(np.cross(n, helper))
+    t2 = np.cross(n, t1)
+    return t1, t2
+
+class SpatialHashGrid:
+    """
+    Uniform 3D grid stored in a NumPy hash table
+
+    Every point is linked into the list of its cell, lookups and inserts
+    are vectorized over all query points and only touch neighbouring cells.
+    """
+    OFFSETS = np.array([(x, y, z) for x in (-1,0,1) for y in (-1,0,1) for z in (-1,0,1)], dtype = np.int64)
+
+    def __init__(self, cell_size, capacity = 1024):
+        self.cell_size = float(cell_size)
+        self.count = 0
+        self.positions = np.empty((capacity, 3))
+        self.next = np.empty(capacity, dtype = np.int64)
+        self._allocateTable(capacity * 2)
+
+    def __len__(self):
+        return self.count
+
+    def _allocateTable(self, size):
+        size = 1 << int(np.ceil(np.log2(max(size, 16))))
+        self._mask = size - 1
+        self._keys = np.full(size, EMPTY, dtype = np.int64)
+        self._heads = np.full(size, -1, dtype = np.int64)
+        self._cells = 0
+
+    def _cellCoords(self, positions):
+        return np.floor(positions / self.cell_size).astype(np.int64)
+
+    def _packKeys(self, coords):
+        # 21 bits per axis, cell coordinates are offset to stay positive
+        c = (coords + (1 << 20)) & ((1 << 21) - 1)
+        return (c[..., 0] << 42) | (c[..., 1] << 21) | c[..., 2]
+
+    def _hash(self, keys):
+        h = keys * np.int64(-7046029254386353131)
+        return (h ^ (h >> 29)) & self._mask
+
+    def _findSlots(self, keys):
+        """
+        Returns table slots for keys - either the slot holding the key or
+        the empty slot where the key would be inserted
+        """
+        slots = self._hash(keys)
+        pending = np.arange(len(keys))
+        while len(pending):
+            stored = self._keys[slots[pending]]
+            done = (stored == keys[pending]) | (stored == EMPTY)
+            pending = pending[~done]
+            slots[pending] = (slots[pending] + 1) & self._mask
+        return slots
+
+    def _reserve(self, count):
+        capacity = len(self.positions)
+        if count > capacity:
+            while capacity < count:
+                capacity *= 2
+            positions = np.empty((capacity, 3))
+            positions[:self.count] = self.positions[:self.count]
+            self.positions = positions
+            self.next = np.empty(capacity, dtype = np.int64)
+
+            # rebuild the links with a larger table
+            self._allocateTable(capacity * 2)
+            self._link(np.arange(self.count))
+
+    def _link(self, indices):
+        """
+        Links already stored points into their cells
+        """
+        keys = self._packKeys(self._cellCoords(self.positions[indices]))
+
+        # claim table slots for new cells, colliding claims retry with the next slot
+        unique_keys = np.unique(keys)
+        while True:
+            slots = self._findSlots(unique_keys)
+            new = self._keys[slots] == EMPTY
+            if not np.any(new):
+                break
+            new_slots, first = np.unique(slots[new], return_index = True)
+            self._keys[new_slots] = unique_keys[new][first]
+            self._cells += len(new_slots)
+
+        slots = self._findSlots(keys)
+
+        # chain points of the same cell, last one links to the previous head
+        order = np.argsort(slots, kind = "stable")
+        slots = slots[order]
+        indices = indices[order]
+
+        same = slots[1:] == slots[:-1]
+        nxt = np.empty(len(indices), dtype = np.int64)
+        nxt[:-1] = np.where(same, indices[1:], -1)
+        if len(indices):
+            nxt[-1] = -1
+
+        last = np.ones(len(indices), dtype = bool)
+        last[:-1] = ~same
+        nxt[last] = self._heads[slots[last]]
+        self.next[indices] = nxt
+
+        first = np.ones(len(indices), dtype = bool)
+        first[1:] = ~same
+        self._heads[slots[first]] = indices[first]
+
+    """ PUBLIC FUNCTIONS """
+
+    def insert(self, positions):
+        positions = np.asarray(positions, dtype = np.float64).reshape(-1, 3)
+        n = len(positions)
+        if n == 0:
+            return
+
+        start = self.count
+        self._reserve(start + n)
+        if (self._cells + n) * 2 > len(self._keys):
+            self._allocateTable((self._cells + n) * 4)
+            self._link(np.arange(start))
+
+        self.positions[start:start + n] = positions
+        self.count = start + n
+        self._link(np.arange(start, start + n))
+
+    def hasNeighbor(self, queries, radius):
+        """
+        Returns a boolean mask of query points (N,3) that have a stored point
+        closer than radius. radius must not be larger than cell_size.
+        """
+        queries = np.asarray(queries, dtype = np.float64).reshape(-1, 3)
+        result = np.zeros(len(queries), dtype = bool)
+        if self.count == 0 or len(queries) == 0:
+            return result
+
+        coords = self._cellCoords(queries)[:, None, :] + self.OFFSETS
+        keys = self._packKeys(coords).ravel()
+        slots = self._findSlots(keys)
+        current = np.where(self._keys[slots] == keys, self._heads[slots], -1)
+        owner = np.repeat(np.arange(len(queries)), len(self.OFFSETS))
+
+        radius2 = radius*radius
+        alive = current >= 0
+        current = current[alive]
+        owner = owner[alive]
+
+        while len(current):
+            offset = self.positions[current] - queries[owner]
+            close = np.einsum("ij,ij->i", offset, offset) < radius2
+            result[owner[close]] = True
+
+            current = self.next[current]
+            alive = (current >= 0) & ~result[owner]
+            current = current[alive]
+            owner = owner[alive]
+
+        return result
+
+    def insertSpaced(self, positions, radius):
+        """
+        Inserts the points (N,3) that are not closer than radius to a stored point
+        or to another inserted one, radius must not be larger than cell_size
+
+        Returns:
+            Boolean mask of the inserted points
+        """
+        positions = np.asarray(positions, dtype = np.float64).reshape(-1, 3)
+        inserted = np.zeros(len(positions), dtype = bool)
+        coords = self._cellCoords(positions)
+        keys = self._packKeys(coords)
+
+        # points in different cells of the same parity are at least one cell apart,
+        # so a round of one point per such cell only has to be tested against the grid
+        parity = (coords & 1) @ np.array((4, 2, 1))
+        remaining = np.ones(len(positions), dtype = bool)
+        while np.any(remaining):
+            for p in range(8):
+                candidates = np.flatnonzero(remaining & (parity == p))
+                if len(candidates) == 0:
+                    continue
+                _, first = np.unique(keys[candidates], return_index = True)
+                candidates = candidates[first]
+                remaining[candidates] = False
+
+                candidates = candidates[~self.hasNeighbor(positions[candidates], radius)]
+                inserted[candidates] = True
+                self.insert(positions[candidates])
+
+        return inserted
+
+class PoissonScatter:
+    """
+    Produces blue-noise samples inside a brush footprint, one batch per stroke step
+
+    Example:
+        scatter = PoissonScatter()
+        scatter.setExisting(existing_positions, min_distance)
+        positions, normals = scatter.step(center, normal, radius, density, softness)
+    """
+    def __init__(self, seed = None, max_candidates = 512):
+        """
+        Keyword Arguments:
+            seed (int) - random seed
+            max_candidates (int) - upper limit of candidates tested per step
+        """
+        self.rng = np.random.default_rng(seed)
+        self.max_candidates = max_candidates
+        self.min_distance = None
+        self.grid = None
+
+    @staticmethod
+    def distanceFromDensity(density):
+        """
+        Minimum sample distance for a density in points per unit area
+        """
+        return 1.0 / np.sqrt(max(density, vmath.EPSILON))
+
+    def setExisting(self, positions, min_distance):
+        """
+        Resets the background grid with existing points samples must respect
+        """
+        self.min_distance = float(min_distance)
+        self.grid = SpatialHashGrid(self.min_distance, capacity = max(len(positions), 1024))
+        self.grid.insert(positions)
+
+    def step(self, center, normal, radius, density, softness = 0.0, project = None):
+        """
+        Generates accepted samples for one brush step
+
+        Keyword Arguments:
+            center (3,) - brush center
+            normal (3,) - brush normal, samples are spread in the perpendicular plane
+            radius (float) - brush radius
+            density (float) - points per unit area at full brush weight
+            softness (float) - 0-1 falloff towards the brush edge
+            project (callable) - optional fn(positions) -> (positions, normals, valid)
+                                 that snaps candidates to a surface, valid masks out misses
+
+        Returns:
+            (positions (N,3), normals (N,3)) of accepted samples, already added to the grid
+        """
+        min_distance = self.distanceFromDensity(density)
+        if self.grid is None or abs(min_distance - self.min_distance) > vmath.EPSILON * min_distance:
+            existing = self.grid.positions[:len(self.grid)] if self.grid is not None else np.empty((0,3))
+            self.setExisting(existing, min_distance)
+
+        area = np.pi * radius * radius
+        count = int(min(self.max_candidates, max(1, np.ceil(area * density * 2.0))))
+
+        # uniform candidates in the footprint disc
+        rng = self.rng
+        r = radius * np.sqrt(rng.random(count))
+        angle = rng.random(count) * 2.0 * np.pi
+        t1, t2 = tangentBasis(normal)
+        center = np.asarray(center, dtype = np.float64)
+        positions = center + (r*np.cos(angle))[:, None] * t1 + (r*np.sin(angle))[:, None] * t2
+
+        # density follows the brush falloff
+        keep = rng.random(count) < falloff(r, radius, softness)
+        positions = positions[keep]
+        normals = np.broadcast_to(vmath.normalize(np.asarray(normal, dtype = np.float64)), positions.shape)
+
+        if project is not None and len(positions):
+            positions, normals, valid = project(positions)
+            positions = positions[valid]
+            normals = normals[valid]
+
+        # candidates of the same step must respect each other too
+        accepted = self.grid.insertSpaced(positions, min_distance)
+
+        positions = np.ascontiguousarray(positions[accepted])
+        normals = np.ascontiguousarray(normals[accepted])
+        return positions, normals
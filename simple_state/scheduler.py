@@ -0,0 +1,264 @@
+import heapq
+import time
+import traceback
+import hou
+
+"""
+
+Cooperative idle scheduler running on the main thread.
+HOM is not thread-safe, so heavy preparation work is written as generator
+tasks which do a small chunk of work between each yield. The scheduler is
+driven by hou.ui event loop callbacks and resumes tasks until the per-tick
+time budget runs out. Each task also has its own budget per tick, a task that
+used it up (or overran it with one long step) waits for later ticks, so lower
+priority tasks still get time. A task that yields a number sleeps for that
+many seconds and is not resumed before then.
+
+Example:
+    def readCollision(self):
+        for i, prim in enumerate(geo.iterPrims()):
+            ...
+            if i % 1000 == 0:
+                yield
+
+    self.scheduleTask(self.readCollision(), name = "collision", priority = 1)
+
+    def commitLater(self):
+        yield 0.4
+        self.radius.defer(False)
+
+"""
+
+class IdleTask:
+    """
+    Handle for a scheduled generator task
+    """
+    def __init__(self, generator, name = None, priority = 0, owner = None, on_done = None, budget = 0.002):
+        self.generator = generator
+        self.name = name
+        self.priority = priority
+        self.owner = owner
+        self.on_done = on_done
+        self.budget = budget
+
+        #Time the task may still use, refilled by budget every tick, overruns carry over
+        self.credit = budget
+        self.tick = 0
+
+        self.is_done = False
+        self.is_cancelled = False
+        self.result = None
+        self.steps = 0
+        self.time = 0.0
+
+    def cancel(self):
+        if not self.is_done:
+            self.is_cancelled = True
+            self.generator.close()
+
+class IdleScheduler:
+    """
+    Runs IdleTasks in time slices from the Houdini event loop
+
+    Tasks with higher priority run first, tasks with the same priority
+    are resumed round robin. All tasks are paused while the user drags
+    the mouse or when the state is interrupted.
+    """
+    def __init__(self, state, budget = 0.005, task_budget = 0.002):
+        """
+        Keyword Arguments:
+            state (FFState) - owning state, used for pause conditions and logging
+            budget (float) - time in seconds the scheduler may spend per event loop tick
+            task_budget (float) - default time in seconds one task may use per tick
+        """
+        self.state = state
+        self.budget = budget
+        self.task_budget = task_budget
+        self.is_running = False
+        self._ticks = 0
+
+        self._queue = []
+        # (wake time, counter, task) of sleeping tasks
+        self._sleeping = []
+        self._counter = 0
+        self._names = {}
+        self._callback = None
+
+    def __len__(self):
+        return sum(1 for e in self._queue + self._sleeping if not e[2].is_done)
+
+    def _push(self, task):
+        self._counter += 1
+        heapq.heappush(self._queue, (-task.priority, self._counter, task))
+
+    def _sleep(self, task, wake_time):
+        self._counter += 1
+        heapq.heappush(self._sleeping, (wake_time, self._counter, task))
+
+    def _wakeUp(self, now):
+        sleeping = self._sleeping
+        while sleeping and sleeping[0][0] <= now:
+            _, _, task = heapq.heappop(sleeping)
+            if not task.is_done:
+                self._push(task)
+
+    def _refill(self, task):
+        if task.tick != self._ticks:
+            task.credit = min(task.credit + task.budget * (self._ticks - task.tick), task.budget)
+            task.tick = self._ticks
+
+    def _finish(self, task):
+        task.is_done = True
+        if task.name is not None and self._names.get(task.name) is task:
+            del self._names[task.name]
+        if task.on_done is not None and not task.is_cancelled:
+            task.on_done(task)
+
+    """ PUBLIC FUNCTIONS """
+
+    def start(self, callback = None):
+        """
+        Registers the scheduler with the Houdini event loop
+
+        Keyword Arguments:
+            callback (callable) - event loop callback that calls tick(), defaults to tick
+        """
+        if not self.is_running:
+            self._callback = callback if callback is not None else self.tick
+            hou.ui.addEventLoopCallback(self._callback)
+            self.is_running = True
+
+    def stop(self):
+        if self.is_running:
+            hou.ui.removeEventLoopCallback(self._callback)
+            self._callback = None
+            self.is_running = False
+
+    def tick(self):
+        if self.isReady():
+            self.run(self.budget)
+
+    def isPaused(self):
+        state = self.state
+        return (not state.is_active) or state.ui.mouse.dragging
+
+    def isReady(self):
+        """
+        True if the scheduler is not paused and a task can run now
+        """
+        if self.isPaused():
+            return False
+        if self._queue:
+            return True
+        return bool(self._sleeping) and self._sleeping[0][0] <= time.perf_counter()
+
+    def schedule(self, generator, name = None, priority = 0, owner = None, on_done = None, delay = 0.0,
+                 budget = None):
+        """
+        Adds a generator task to the scheduler
+
+        Keyword Arguments:
+            name (str) - scheduling a task with a name that is already queued cancels the old task
+            priority (int) - higher priority tasks run first
+            owner (FFAction) - action that owns the task, see cancelOwner()
+            on_done (callable) - called with the task once the generator is exhausted
+            delay (float) - seconds before the task runs for the first time
+            budget (float) - seconds the task may run per tick, defaults to task_budget
+
+        Returns:
+            IdleTask
+        """
+        if name is not None:
+            self.cancel(name)
+
+        task = IdleTask(generator, name = name, priority = priority, owner = owner, on_done = on_done,
+                        budget = self.task_budget if budget is None else budget)
+        if name is not None:
+            self._names[name] = task
+        if delay > 0.0:
+            self._sleep(task, time.perf_counter() + delay)
+        else:
+            self._push(task)
+        return task
+
+    def cancel(self, task):
+        """
+        Cancels a task by IdleTask or by name
+        """
+        if isinstance(task, str):
+            task = self._names.pop(task, None)
+        if task is not None:
+            task.cancel()
+            self._finish(task)
+
+    def cancelOwner(self, owner):
+        for _, _, task in self._queue + self._sleeping:
+            if task.owner is owner and not task.is_done:
+                self.cancel(task)
+
+    def clear(self):
+        for _, _, task in self._queue + self._sleeping:
+            if not task.is_done:
+                self.cancel(task)
+        self._queue = []
+        self._sleeping = []
+        self._names = {}
+
+    def run(self, budget):
+        """
+        Resumes queued tasks until the budget (seconds) is used up,
+        tasks without credit left are held back until a later tick
+
+        Returns:
+            Number of steps executed
+        """
+        start = time.perf_counter()
+        deadline = start + budget
+        steps = 0
+        self._ticks += 1
+
+        self._wakeUp(start)
+        queue = self._queue
+        held = []
+        while queue:
+            _, _, task = heapq.heappop(queue)
+            if task.is_done:
+                continue
+            self._refill(task)
+            if task.credit <= 0.0:
+                held.append(task)
+                continue
+
+            step_start = time.perf_counter()
+            try:
+                task.result = next(task.generator)
+                alive = True
+            except StopIteration as e:
+                task.result = e.value
+                alive = False
+            except Exception:
+                self.state.debug("Idle task %s failed\n%s" % (task.name, traceback.format_exc()))
+                alive = False
+            now = time.perf_counter()
+
+            task.steps += 1
+            task.time += now - step_start
+            task.credit -= now - step_start
+            steps += 1
+
+            if alive:
+                # a yielded number puts the task to sleep
+                delay = task.result
+                if isinstance(delay, (int, float)) and not isinstance(delay, bool) and delay > 0:
+                    self._sleep(task, now + delay)
+                else:
+                    self._push(task)
+            else:
+                self._finish(task)
+
+            if now >= deadline:
+                break
+
+        for task in held:
+            self._push(task)
+        return steps
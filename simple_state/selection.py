@@ -0,0 +1,244 @@
+import numpy as np
+import hou
+
+"""
+
+Selection sets stored as NumPy boolean masks over point/prim indices.
+All select functions work on whole arrays of projected positions
+(see picking.ScreenPointCache) and results are written back to
+geometry or parameters in one bulk call.
+
+"""
+
+REPLACE = 0
+ADD = 1
+REMOVE = 2
+TOGGLE = 3
+
+def modeFromModifiers(shift = False, ctrl = False):
+    """
+    Houdini selection convention - shift adds, ctrl removes, ctrl+shift toggles
+    """
+    if shift and ctrl:
+        return TOGGLE
+    if shift:
+        return ADD
+    if ctrl:
+        return REMOVE
+    return REPLACE
+
+def pointsInBox(screen, x0, y0, x1, y1):
+    """
+    Returns a boolean mask of screen positions (N,2) inside the box
+    """
+    xmin, xmax = min(x0, x1), max(x0, x1)
+    ymin, ymax = min(y0, y1), max(y0, y1)
+    x = screen[:, 0]
+    y = screen[:, 1]
+    return (x >= xmin) & (x <= xmax) & (y >= ymin) & (y <= ymax)
+
+def pointsInPolygon(screen, polygon):
+    """
+    Returns a boolean mask of screen positions (N,2) inside polygon (M,2)
+    using the even-odd rule. Points are tested together for each polygon edge.
+    """
+    polygon = np.asarray(polygon, dtype = np.float64)
+    inside = np.zeros(len(screen), dtype = bool)
+    if len(polygon) < 3:
+        return inside
+
+    # cheap bounding box rejection before the edge loop
+    lo = polygon.min(axis = 0)
+    hi = polygon.max(axis = 0)
+    candidates = np.nonzero(pointsInBox(screen, lo[0], lo[1], hi[0], hi[1]))[0]
+    if len(candidates) == 0:
+        return inside
+
+    x = screen[candidates, 0]
+    y = screen[candidates, 1]
+    crossings = np.zeros(len(candidates), dtype = bool)
+
+    x0, y0 = polygon[-1]
+    for x1, y1 in polygon:
+        if y0 != y1:
+            crosses = (y1 > y) != (y0 > y)
+            x_cross = x0 + (y - y0) * (x1 - x0) / (y1 - y0)
+            crossings ^= crosses & (x < x_cross)
+        x0, y0 = x1, y1
+
+    inside[candidates] = crossings
+    return inside
+
+def maskToPattern(mask):
+    """
+    Converts a boolean mask to a Houdini group pattern ("0-9 12 20-31")
+    """
+    indices = np.flatnonzero(mask)
+    if len(indices) == 0:
+        return ""
+
+    breaks = np.flatnonzero(np.diff(indices) != 1)
+    starts = indices[np.concatenate(([0], breaks + 1))]
+    ends = indices[np.concatenate((breaks, [len(indices) - 1]))]
+
+    return " ".join(str(s) if s == e else "%d-%d" % (s, e) for s, e in zip(starts.tolist(), ends.tolist()))
+
+def patternToMask(pattern, count):
+    """
+    Converts a numeric group pattern back to a boolean mask of size count
+    """
+    mask = np.zeros(count, dtype = bool)
+    for token in pattern.split():
+        if "-" in token:
+            start, end = token.split("-", 1)
+            mask[int(start):int(end) + 1] = True
+        elif token.isdigit():
+            index = int(token)
+            if index < count:
+                mask[index] = True
+    return mask
+
+class SelectionSet:
+    """
+    Boolean mask selection over point or primitive indices
+    """
+    def __init__(self, count = 0, element = "point"):
+        """
+        Keyword Arguments:
+            count (int) - number of selectable elements
+            element (str) - "point" or "prim", used when writing groups and attributes
+        """
+        self.element = element
+        self.mask = np.zeros(count, dtype = bool)
+        self._stroke_mask = None
+        self._stroke_mode = REPLACE
+
+    def __len__(self):
+        return int(np.count_nonzero(self.mask))
+
+    """ PUBLIC FUNCTIONS """
+
+    def resize(self, count):
+        """
+        Resizes the mask keeping the selection of existing indices
+        """
+        if count != len(self.mask):
+            mask = np.zeros(count, dtype = bool)
+            n = min(count, len(self.mask))
+            mask[:n] = self.mask[:n]
+            self.mask = mask
+
+    def clear(self):
+        self.mask[:] = False
+
+    def indices(self):
+        return np.flatnonzero(self.mask)
+
+    def apply(self, selected, mode = REPLACE):
+        """
+        Combines a boolean mask or an index array with the current selection
+        """
+        selected = np.asarray(selected)
+        if selected.dtype != bool:
+            index_mask = np.zeros(len(self.mask), dtype = bool)
+            index_mask[selected] = True
+            selected = index_mask
+
+        if mode == REPLACE:
+            self.mask[:] = selected
+        elif mode == ADD:
+            self.mask |= selected
+        elif mode == REMOVE:
+            self.mask &= ~selected
+        elif mode == TOGGLE:
+            self.mask ^= selected
+
+    def selectBox(self, screen, x0, y0, x1, y1, mode = REPLACE, visible = None):
+        selected = pointsInBox(screen, x0, y0, x1, y1)
+        if visible is not None:
+            selected &= visible
+        self.apply(selected, mode)
+
+    def selectLasso(self, screen, polygon, mode = REPLACE, visible = None):
+        selected = pointsInPolygon(screen, polygon)
+        if visible is not None:
+            selected &= visible
+        self.apply(selected, mode)
+
+    def selectRadius(self, point_cache, x, y, radius, mode = REPLACE):
+        """
+        Selects points of a picking.ScreenPointCache within radius pixels of (x, y)
+        """
+        self.apply(point_cache.query(x, y, radius), mode)
+
+    def beginStroke(self, mode = REPLACE):
+        """
+        Starts an interactive stroke, toggle mode flips every element
+        only once per stroke no matter how often the brush passes over it
+        """
+        if mode == REPLACE:
+            self.clear()
+        self._stroke_mask = np.zeros(len(self.mask), dtype = bool)
+        self._stroke_mode = mode
+
+    def strokeIndices(self, indices):
+        """
+        Adds brushed indices to the current stroke
+        """
+        if self._stroke_mask is None:
+            self.beginStroke()
+        mode = self._stroke_mode
+
+        stroke = self._stroke_mask
+        new = np.zeros(len(stroke), dtype = bool)
+        new[indices] = True
+        new &= ~stroke
+        stroke |= new
+
+        self.apply(new, ADD if mode == REPLACE else mode)
+
+    def endStroke(self):
+        self._stroke_mask = None
+
+    def toPattern(self):
+        return maskToPattern(self.mask)
+
+    def fromPattern(self, pattern):
+        self.mask = patternToMask(pattern, len(self.mask))
+
+    def writeParm(self, parm):
+        """
+        Writes the selection as a group pattern to a string parm (hou.Parm or FFParm)
+        """
+        parm.set(self.toPattern())
+
+    def writeGroup(self, geo, name):
+        """
+        Replaces the contents of a group on writable hou.Geometry in one call
+        """
+        pattern = self.toPattern()
+        if self.element == "prim":
+            group = geo.findPrimGroup(name) or geo.createPrimGroup(name)
+            elements = geo.globPrims(pattern) if pattern else ()
+        else:
+            group = geo.findPointGroup(name) or geo.createPointGroup(name)
+            elements = geo.globPoints(pattern) if pattern else ()
+
+        group.clear()
+        if len(elements) > 0:
+            group.add(elements)
+        return group
+
+    def writeAttrib(self, geo, name):
+        """
+        Writes the selection as a 0/1 int attribute on writable hou.Geometry in one call
+        """
+        values = self.mask.astype(np.int32)
+        if self.element == "prim":
+            if geo.findPrimAttrib(name) is None:
+                geo.addAttrib(hou.attribType.Prim, name, 0)
+            geo.setPrimIntAttribValuesFromString(name, values.tobytes())
+        else:
+            if geo.findPointAttrib(name) is None:
+                geo.addAttrib(hou.attribType.Point, name, 0)
+            geo.setPointIntAttribValuesFromString(name, values.tobytes())
@@ -0,0 +1,249 @@
+import numpy as np
+import hou
+
+"""
+
+Small math layer backed by preallocated NumPy buffers.
+All build functions write into an 'out' buffer and work on single
+values (3,) -> (4,4) as well as batches (N,3) -> (N,4,4).
+
+Matrices follow the HOM row-vector convention (v * M), so translation lives
+in the last row and A * B applies A first. HOM types are only created
+at the API boundary with toMatrix4() / toVector3().
+
+"""
+
+X_AXIS = np.array((1.0, 0.0, 0.0))
+Y_AXIS = np.array((0.0, 1.0, 0.0))
+Z_AXIS = np.array((0.0, 0.0, 1.0))
+
+EPSILON = 1e-8
+
+def vec3(value = None):
+    """
+    Returns a new (3,) float buffer, optionally filled from a hou.Vector3/sequence
+    """
+    out = np.zeros(3)
+    if value is not None:
+        assign(out, value)
+    return out
+
+def mat4(value = None):
+    """
+    Returns a new (4,4) float buffer, identity by default
+    """
+    out = np.identity(4)
+    if value is not None:
+        assign(out, value)
+    return out
+
+def assign(out, value):
+    """
+    Copies a hou.Vector3/hou.Matrix4/sequence/scalar into an existing buffer
+    """
+    if isinstance(value, hou.Matrix4):
+        out[...] = np.reshape(value.asTuple(), (4,4))
+    else:
+        out[...] = value
+    return out
+
+def toVector3(value, out = None):
+    if out is None:
+        return hou.Vector3(value.tolist())
+    out.setTo(value.tolist())
+    return out
+
+def toMatrix4(value, out = None):
+    """
+    Converts a (4,4) buffer to a hou.Matrix4, reusing 'out' if given
+    """
+    if out is None:
+        return hou.Matrix4(value.ravel().tolist())
+    out.setTo(value.ravel().tolist())
+    return out
+
+""" BUILD FUNCTIONS """
+
+def identity(out):
+    out[...] = 0.0
+    out[..., 0, 0] = 1.0
+    out[..., 1, 1] = 1.0
+    out[..., 2, 2] = 1.0
+    out[..., 3, 3] = 1.0
+    return out
+
+def buildScale(scale, out):
+    identity(out)
+    out[..., 0, 0] = scale[..., 0]
+    out[..., 1, 1] = scale[..., 1]
+    out[..., 2, 2] = scale[..., 2]
+    return out
+
+def buildTranslate(position, out):
+    identity(out)
+    out[..., 3, :3] = position
+    return out
+
+def buildRotate(degrees, out):
+    """
+    Same as hou.hmath.buildRotate(degrees) with the default 'xyz' order
+    """
+    rad = np.radians(degrees)
+    c = np.cos(rad)
+    s = np.sin(rad)
+    cx, cy, cz = c[..., 0], c[..., 1], c[..., 2]
+    sx, sy, sz = s[..., 0], s[..., 1], s[..., 2]
+
+    identity(out)
+    out[..., 0, 0] = cy*cz
+    out[..., 0, 1] = cy*sz
+    out[..., 0, 2] = -sy
+    out[..., 1, 0] = sx*sy*cz - cx*sz
+    out[..., 1, 1] = sx*sy*sz + cx*cz
+    out[..., 1, 2] = sx*cy
+    out[..., 2, 0] = cx*sy*cz + sx*sz
+    out[..., 2, 1] = cx*sy*sz - sx*cz
+    out[..., 2, 2] = cx*cy
+    return out
+
+def buildRotateZToAxis(axis, out):
+    """
+    Shortest rotation taking +Z onto axis, like hou.hmath.buildRotateZToAxis()
+    An axis opposite to +Z has no unique shortest rotation, a half turn around X
+    is used here, which is not guaranteed to be the rotation hou.hmath picks
+    """
+    a = normalize(axis)
+    ax, ay, az = a[..., 0], a[..., 1], a[..., 2]
+
+    flipped = az < -1.0 + EPSILON
+    k = 1.0 / np.where(flipped, 1.0, 1.0 + az)
+    vx = -ay
+    vy = ax
+    s2 = vx*vx + vy*vy
+
+    identity(out)
+    out[..., 0, 0] = 1.0 + k*(vx*vx - s2)
+    out[..., 0, 1] = k*vx*vy
+    out[..., 0, 2] = -vy
+    out[..., 1, 0] = k*vx*vy
+    out[..., 1, 1] = 1.0 + k*(vy*vy - s2)
+    out[..., 1, 2] = vx
+    out[..., 2, 0] = vy
+    out[..., 2, 1] = -vx
+    out[..., 2, 2] = 1.0 - k*s2
+
+    if np.any(flipped):
+        out[flipped, :3, :3] = np.diag((1.0, -1.0, -1.0))
+    return out
+
+def buildRotateLookAt(direction, up, out):
+    """
+    Rotation pointing -Z along direction with +Y towards up,
+    same as hou.hmath.buildRotateLookAt(origin, origin + direction, up)
+    """
+    z = -normalize(direction)
+    x = np.cross(up, z)
+    length = np.linalg.norm(x, axis = -1, keepdims = True)
+
+    # up parallel to direction - fall back to a stable perpendicular
+    parallel = length[..., 0] < EPSILON
+    if np.any(parallel):
+        alt = np.where(np.abs(z[..., 0:1]) < 0.9, X_AXIS, Y_AXIS)
+        x = np.where(parallel[..., None], np.cross(alt, z), x)
+        length = np.linalg.norm(x, axis = -1, keepdims = True)
+
+    x /= length
+    y = np.cross(z, x)
+
+    identity(out)
+    out[..., 0, :3] = x
+    out[..., 1, :3] = y
+    out[..., 2, :3] = z
+    return out
+
+def intersectPlane(origins, directions, point, normal):
+    """
+    Intersects rays (N,3) with the plane through point with normal
+
+    Returns:
+        (positions (N,3), valid (N,) mask of rays not parallel to the plane)
+    """
+    denom = directions @ normal
+    parallel = np.abs(denom) <= EPSILON
+    t = ((point - origins) @ normal) / np.where(parallel, 1.0, denom)
+    positions = origins + directions * t[..., None]
+    return positions, np.broadcast_to(~parallel, t.shape)
+
+def normalize(v):
+    length = np.linalg.norm(v, axis = -1, keepdims = True)
+    return v / np.maximum(length, EPSILON)
+
+def compose(matrices, out, tmp = None):
+    """
+    Multiplies matrices from left to right (first matrix is applied first)
+    into 'out' without allocating intermediate results when 'tmp' is given
+    """
+    if tmp is None:
+        tmp = np.empty_like(out)
+
+    # pick the starting buffer so the final product ends up in 'out'
+    steps = len(matrices) - 1
+    a, b = (out, tmp) if steps % 2 == 1 else (tmp, out)
+    b[...] = matrices[0]
+    for m in matrices[1:]:
+        np.matmul(b, m, out = a)
+        a, b = b, a
+    return out
+
+""" BUFFERS """
+
+class Ray:
+    """
+    Ray origin/direction buffers updated in place on every mouse event
+    """
+    __slots__ = ("origin", "dir")
+
+    def __init__(self):
+        self.origin = np.zeros(3)
+        self.dir = np.array((0.0, -1.0, 0.0))
+
+    def set(self, origin, direction):
+        self.origin[:] = origin
+        self.dir[:] = direction
+
+class HitResult:
+    """
+    Reusable intersection result,
+    keeps one set of hou.Vector3 scratch objects for hou.Geometry.intersect()
+    """
+    __slots__ = ("position", "normal", "uvw", "prim", "_position", "_normal", "_uvw")
+
+    def __init__(self):
+        self.position = np.zeros(3)
+        self.normal = np.array((0.0, 1.0, 0.0))
+        self.uvw = np.zeros(3)
+        self.prim = -1
+
+        self._position = hou.Vector3()
+        self._normal = hou.Vector3()
+        self._uvw = hou.Vector3()
+
+    def intersect(self, geo, origin, direction):
+        """
+        Intersects hou.Geometry and stores the result in place
+
+        Returns:
+            Primitive number that was hit or -1
+        """
+        prim = geo.intersect(origin, direction, self._position, self._normal, self._uvw)
+        if prim >= 0:
+            self.position[:] = self._position
+            self.normal[:] = self._normal
+            self.uvw[:] = self._uvw
+        self.prim = prim
+        return prim
+
+    def set(self, position, normal, prim = -1):
+        self.position[:] = position
+        self.normal[:] = normal
+        self.prim = prim
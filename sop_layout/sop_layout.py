@@ -7,6 +7,7 @@ Date Created:   March 20, 2025 - 09:56:46
 """
 
 import hou
+import numpy as np
 import viewerstate.utils as su
 from imp import reload
 
@@ -20,19 +21,182 @@ reload(..simple_state.drawable)
 
 from ..simple_state.core import *
 from ..simple_state.actions import *
+from ..simple_state import vmath
+from ..simple_state import picking
+from ..simple_state import selection
+from ..simple_state import insertion
+from ..simple_state import scatter
+from ..simple_state import preview
+from ..simple_state import collision
+from ..simple_state import diskcache
 
 class Select(KeyToggleAction, MenuParmAction):
-    pass
+    """
+    Hover + paint selection of instance points,
+    shift adds, ctrl removes, ctrl+shift toggles
+    """
+
+    HOVER_RADIUS = 12
+    SELECT_RADIUS = 24
+    SELECTION_PARM = "selection"
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.addCallback('onMouse', self._hoverPoint)
+        self.addCallback('onMouse', self._paintSelection)
+
+    def init(self):
+        self.point_cache = picking.ScreenPointCache()
+        self.selection = selection.SelectionSet()
+        self.is_painting = False
+
+        self.selection_parm = None
+        if self.state.node.parm(self.SELECTION_PARM) is not None:
+            self.selection_parm = self.hookParm(self.SELECTION_PARM)
+
+    def prewarm(self):
+        self._loadPoints()
+
+    def _loadPoints(self):
+        node = self.state.node
+        self.point_cache.setGeometry(node.geometry(), version = node.cookCount())
+        self.selection.resize(len(self.point_cache.positions))
+
+    def _hoverPoint(self, event = None):
+        if not self.is_active:
+            return
+
+        ui = self.state.ui
+        node = self.state.node
+        cache = self.point_cache
+
+        self._loadPoints()
+        cache.update(ui.viewport, ancestorObject(node).worldTransform())
+
+        ui.hovered = cache.hover(ui.mouse.x, ui.mouse.y, self.HOVER_RADIUS)
+
+    def _paintSelection(self, event = None):
+        if not self.is_active:
+            return
+
+        mouse = self.state.ui.mouse
+        reason = mouse.reason
+
+        if reason == hou.uiEventReason.Start or reason == hou.uiEventReason.Picked:
+            device = mouse.device
+            mode = selection.modeFromModifiers(device.isShiftKey(), device.isCtrlKey())
+            self.selection.beginStroke(mode)
+            self.is_painting = True
+
+        if not self.is_painting:
+            return
+
+        self.selection.strokeIndices(self.point_cache.query(mouse.x, mouse.y, self.SELECT_RADIUS))
+
+        if reason == hou.uiEventReason.Changed or reason == hou.uiEventReason.Picked:
+            self.selection.endStroke()
+            self.is_painting = False
+            self.commitSelection()
+
+    def commitSelection(self):
+        """
+        Writes the whole selection to the node in one parm set
+        """
+        if self.selection_parm is not None:
+            self.selection.writeParm(self.selection_parm)
+
+    def finish(self):
+        self.state.ui.hovered = -1
+        if self.is_painting:
+            self.selection.endStroke()
+            self.is_painting = False
+            self.commitSelection()
 
 class Add(KeyToggleAction, MenuParmAction):
-    pass
+    """
+    Click/drag placement of new instance points,
+    placements go into the stash geometry in batches, the stash parm
+    is written once per drag
+    """
+
+    SPACING = 0.5
+    FLUSH_SIZE = 256
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.addCallback('onMouse', self._placePoints)
+
+    def init(self):
+        self.engine = insertion.InsertionEngine(flush_size = self.FLUSH_SIZE, on_flush = self._stashChanged)
+        self.stash_dirty = False
+        self.last_position = None
+
+    def prewarm(self):
+        self.state.loadStash(self.engine)
+
+    def start(self):
+        self.state.loadStash(self.engine)
+
+    def finish(self):
+        self._commitGeometry()
+        self.last_position = None
+
+    def _placePoints(self, event = None):
+        if not self.is_active:
+            return
+
+        ui = self.state.ui
+        reason = ui.mouse.reason
+        placing = reason == hou.uiEventReason.Start or reason == hou.uiEventReason.Active \
+            or reason == hou.uiEventReason.Picked
+
+        if placing:
+            position, normal = self.state.getNodeCollision(ui.ray.origin, ui.ray.dir)
+            last = self.last_position
+            if last is None or np.linalg.norm(position - last) >= self.SPACING:
+                self.engine.add(position, normal)
+                self.last_position = np.array(position)
+
+        if reason == hou.uiEventReason.Changed or reason == hou.uiEventReason.Picked:
+            self._commitGeometry()
+            self.last_position = None
+
+    def _stashChanged(self, geo):
+        # batches flushed during a drag only go into the in-memory geometry
+        self.stash_dirty = True
+
+    def _commitGeometry(self):
+        """
+        Flushes pending placements and writes the stash parm, the HDA cooks once per drag
+        """
+        self.engine.flush()
+        if self.stash_dirty:
+            self.state.writeStash(self.engine.geo)
+        self.stash_dirty = False
 
 class Brush(KeyToggleAction, MenuParmAction, DrawableAction):
+    """
+    Paints instance points with Poisson-disk spacing,
+    brush_density sets points per unit area, brush_softness the edge falloff
+    """
+
+    FLUSH_SIZE = 4096
+    #Scatter candidates (and collision rays) per stroke step at full quality
+    MAX_CANDIDATES = 512
+    #Copy node of the HDA that instances geometry onto the layout points
+    COPY_NODE = "COPY_Instances"
 
     class Scale(MouseWheelAction):
+        #Seconds without wheel input before the radius is written to the node
+        COMMIT_DELAY = 0.4
+
         def init(self):
             pass
 
+        def _commitLater(self, parm):
+            yield self.COMMIT_DELAY
+            parm.defer(False)
+
         def start(self):
             if self.parent_event is not None:
                 radius = self.parent_event.radius.eval()
@@ -45,7 +209,18 @@ class Brush(KeyToggleAction, MenuParmAction, DrawableAction):
             radius *= 1+scroll*0.2
 
             self.state.debug("Brush Radius: %d" % radius, Debug.MOUSEWHEEL)
-            self.parent_event.radius.set(radius)
+
+            # only the cursor follows the wheel, the node cooks once scrolling stops
+            parm = self.parent_event.radius
+            parm.defer(True)
+            parm.set(radius)
+            self.passEventToParent('onDraw')
+            self.scheduleTask(self._commitLater(parm), name = "brush_radius_commit")
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.addCallback('onMouse', self._paintPoints)
+        self.cursor = None
 
     def init(self):
         self.cursor = BrushDrawable(self,"brush")
@@ -53,10 +228,135 @@ class Brush(KeyToggleAction, MenuParmAction, DrawableAction):
         self.radius = self.hookParm("brush_radius")
         self.softness = self.hookParm("brush_softness")
         self.density = self.hookParm("brush_density")
+
+        self.scatter = scatter.PoissonScatter(max_candidates = self.MAX_CANDIDATES)
+        self.scatter_version = None
+        self.engine = insertion.InsertionEngine(flush_size = self.FLUSH_SIZE)
+        self.is_painting = False
+
+        # painted points are previewed by running the HDA's copy verb on its frozen instance geometry,
+        # the stash parm is only written on stroke end
+        copy_node = self.state.node.node(self.COPY_NODE)
+        source_geo = preview.VerbPreview.cacheInput(copy_node) if copy_node is not None else None
+
+        chain = preview.VerbPreview()
+        if source_geo is not None:
+            chain.addStep(copy_node, inputs = (source_geo, None))
+        else:
+            # HDA without the copy node - proxy boxes
+            source_geo = hou.Geometry()
+            hou.sopNodeTypeCategory().nodeVerb("box").execute(source_geo, [])
+            chain.addStep("copytopoints::2.0", inputs = (source_geo, None))
+
+        self.preview = preview.InstancedPreview(source_geo, chain = chain)
+        self.preview_drawable = self.bindDrawable(geo = self.preview.geo, name = "preview", world_space = True)
         
     def refresh(self):
         pass
 
+    def qualityChanged(self, level):
+        if self.cursor is None:
+            return
+        quality = self.state.quality
+        self.cursor.setResolution(quality.scale(BrushDrawable.RESOLUTION, 8))
+        self.scatter.max_candidates = quality.scale(self.MAX_CANDIDATES, 64)
+
+    def prewarm(self):
+        self._loadExisting()
+        yield
+        self.state.loadStash(self.engine)
+
+    def _loadExisting(self):
+        node = self.state.node
+
+        # existing points only need to be reloaded after a recook
+        version = node.cookCount()
+        if version != self.scatter_version:
+            min_distance = scatter.PoissonScatter.distanceFromDensity(self.density.eval())
+            self.scatter.setExisting(picking.readPositions(node.geometry()), min_distance)
+            self.scatter_version = version
+
+    def _beginStroke(self):
+        self._loadExisting()
+        self.state.loadStash(self.engine)
+
+    def _projectSamples(self, positions):
+        """
+        Snaps brush samples to the collision surface, all samples are cast
+        together against the cached collision grid, misses land on the construction plane
+        """
+        state = self.state
+        ray = state.ui.ray
+        direction = ray.buffer.dir
+        radius = self.radius.eval()
+        origins = positions - direction * radius
+
+        grid = state.collision_grid
+        if grid is not None:
+            projected, normals, hit = grid.intersect(origins, direction, radius * 2.0)
+        else:
+            projected = np.empty_like(positions)
+            normals = np.empty_like(positions)
+            hit = np.zeros(len(positions), dtype = bool)
+        valid = hit.copy()
+
+        missed = np.flatnonzero(~hit)
+        if state.enable_collision and grid is None:
+            # the grid failed to build, only HOM can intersect the collision geometry
+            for i in missed.tolist():
+                position, normal = state.getNodeCollision(hou.Vector3(origins[i].tolist()), ray.dir)
+                projected[i] = position
+                normals[i] = normal
+            valid[missed] = True
+        elif len(missed):
+            point, normal = state.constructionPlane()
+            projected[missed], valid[missed] = vmath.intersectPlane(origins[missed], direction, point, normal)
+            normals[missed] = vmath.Y_AXIS
+        return projected, normals, valid
+
+    def _paintPoints(self, event = None):
+        if not self.is_active:
+            return
+
+        ui = self.state.ui
+        reason = ui.mouse.reason
+
+        if reason == hou.uiEventReason.Start or reason == hou.uiEventReason.Picked:
+            self._beginStroke()
+            self.is_painting = True
+
+        if not self.is_painting:
+            return
+
+        if reason in (hou.uiEventReason.Start, hou.uiEventReason.Active, hou.uiEventReason.Picked):
+            # copies - getNodeCollision reuses its result buffers for every sample
+            center, normal = (np.array(x) for x in self.state.getNodeCollision(ui.ray.origin, ui.ray.dir))
+            positions, normals = self.scatter.step(center, normal, self.radius.eval(),
+                self.density.eval(), self.softness.eval(), project = self._projectSamples)
+            orients = insertion.orientFromNormal(normals)
+
+            self.engine.addMany(positions, normals, orients)
+            self.preview.append(positions, orients)
+            self.preview.push(self.preview_drawable)
+
+        if reason == hou.uiEventReason.Changed or reason == hou.uiEventReason.Picked:
+            self._endStroke()
+
+    def _endStroke(self):
+        self.engine.flush()
+        self.is_painting = False
+        self.preview.clear()
+        self.preview.push(self.preview_drawable)
+
+        if self.engine.geo is not None:
+            self.state.writeStash(self.engine.geo)
+
+    def finish(self):
+        if self.is_painting:
+            self._endStroke()
+        # a radius still waiting for the delayed wheel commit is written now
+        self.radius.defer(False)
+
 
 
     def draw(self):
@@ -72,10 +372,14 @@ class Brush(KeyToggleAction, MenuParmAction, DrawableAction):
 
 
 class MyState(FFState):
+    #Size limit of the collision cache on disk
+    CACHE_SIZE = 1 << 30
+    #Geometry data parm holding the points placed by Add and Brush
+    STASH_PARM = "stash_add"
 
     def onBuild(self):
         self.hookActions((
-            ToggleManager(state = self, use_default = False, events = (
+            ToggleManager(state = self, use_default = False, prewarm = "idle", events = (
                 Select(state = self, name = "op_select", label = "Select",
                     hotkey = "s", menu_parm = "optool", menu_id = 0 ),
                 Add(state = self, name = "op_add", label = "Add",
@@ -93,34 +397,89 @@ class MyState(FFState):
 
 
     def onStart(self): 
+        self.hit = vmath.HitResult()
+        #Counts stash parm writes of all tools, see loadStash()
+        self.stash_writes = 0
+        self.stash_geo = None
+        self.stash_version = None
         self.enable_collision = self.node.input(1) != None
+        self.collision_grid = None
         if self.enable_collision:
             self.collision_geo = self.node.node("OUT_Collision").geometry()
 
-    def getNodeCollision(self, origin, direction, freeze = True, intersect_self = False):
-        position = hou.Vector3()
-        normal = hou.Vector3()
-        uvw = hou.Vector3()
+            # static environments are mapped from disk instead of being rebuilt on every enter,
+            # states in other viewers share the same grid
+            collision_node = self.node.node("OUT_Collision")
+            cache = diskcache.DiskCache(max_bytes = self.CACHE_SIZE)
+            try:
+                self.collision_grid = self.acquireResource("collision_grid",
+                    lambda: collision.TriangleGrid.fromGeometry(self.collision_geo, cache = cache),
+                    version = collision_node.cookCount(),
+                    # the grid is memory-mapped, its arrays are counted explicitly
+                    nbytes = lambda grid: grid.nbytes)
+            except hou.Error:
+                self.debug("Collision grid failed!")
+
+    def loadStash(self, engine):
+        """
+        Points the insertion engine of a tool at the stash geometry shared by all tools,
+        the stash parm is only read again after a recook or a stash write
+        """
+        version = (self.node.cookCount(), self.stash_writes)
+        if version != self.stash_version:
+            geo = hou.Geometry()
+            parm = self.node.parm(self.STASH_PARM)
+            stashed = parm.evalAsGeometry() if parm is not None else None
+            if stashed is not None:
+                geo.merge(stashed)
+            self.stash_geo = geo
+            self.stash_version = version
+
+        if engine.geo is not self.stash_geo:
+            engine.setGeometry(self.stash_geo)
+
+    def writeStash(self, geo):
+        """
+        Writes geo to the stash parm, the next loadStash() reads it back
+        """
+        parm = self.node.parm(self.STASH_PARM)
+        if parm is not None:
+            self.writeParm(parm, geo)
+            self.stash_writes += 1
+
+    def constructionPlane(self):
+        """
+        Returns (point, normal) of the construction plane in world space
+        """
+        xform = vmath.mat4(self.scene_viewer.constructionPlane().transform())
+        normal = vmath.normalize(vmath.Z_AXIS @ np.linalg.inv(xform)[:3, :3].T)
+        return xform[3, :3], normal
 
+    def getNodeCollision(self, origin, direction, freeze = True, intersect_self = False):
+        """
+        Returns position and normal as NumPy buffers owned by self.hit,
+        they are overwritten by the next call
+        """
+        hit_result = self.hit
         hit = -1
-
-
+        # the buffers still hold the previous hit, a failed intersection must not return it
+        hit_result.set(0.0, vmath.Y_AXIS)
 
         try:
             if intersect_self:
                 self.instance_geo = self.node.geometry().freeze(True)
-                hit = self.instance_geo.intersect(origin,direction,position,normal,uvw)
+                hit = hit_result.intersect(self.instance_geo, origin, direction)
 
             if hit < 0:
                 if self.enable_collision:
-                    hit = self.collision_geo.intersect(origin,direction,position,normal,uvw)
+                    hit = hit_result.intersect(self.collision_geo, origin, direction)
             if hit < 0:
                 position = su.cplaneIntersection(self.scene_viewer, origin, direction)
-                normal = hou.Vector3(0,1,0)
+                hit_result.set(position, vmath.Y_AXIS)
         except:
             self.debug("Node Collision failed!")
 
-        return position, normal
+        return hit_result.position, hit_result.normal
 
 
 